@@ -0,0 +1,94 @@
+'''
+Measures the peak memory of a jira_digest run as the number of issues
+grows. Each scale runs in its own process, since the peak resident
+memory of a process never goes down.
+
+    python benchmarks/bench_memory.py [scale ...]
+
+Issues are generated one at a time, as search_issues hands them over,
+so the growth shows what the digest itself keeps alive. The digest is
+sent to a discarding SMTP server in another process, as send_digest
+sends it.
+'''
+import json
+import multiprocessing
+import subprocess
+import sys
+import time
+
+import bench_smtp
+import fake_data
+from fake_data import REPO_DIR
+
+sys.path.insert(0, REPO_DIR)
+from common import delivery, instrumentation
+import jira_digest
+
+
+SCALES = [10 ** 3, 10 ** 4, 10 ** 5]
+DIGEST_USER = 'user0'
+
+
+def run_child(scale):
+    '''Runs the digest pipeline on scale issues and returns peak memory
+    '''
+    baseline = instrumentation.peak_memory_kb()
+    args = jira_digest.parse_args([
+        '--user', DIGEST_USER,
+        '--email', 'digest@example.com'
+    ])
+    issues = (
+        fake_data.to_record(raw)
+        for raw in fake_data.iter_fake_jira_issue_dicts(scale)
+    )
+    issues_to_events = jira_digest.get_issue_events(issues, args)
+    issues_to_summaries = jira_digest.summarize_for_user(
+        issues_to_events,
+        DIGEST_USER
+    )
+    with delivery.SMTPSession(None, None, bench_smtp.HOST, bench_smtp.PORT) as smtp:
+        jira_digest.send_digest(smtp, issues_to_summaries, args)
+        message_bytes = instrumentation.recorder().call_totals(
+            'smtp.sendmail'
+        )['bytes_sent']
+    return {
+        'scale': scale,
+        'baseline_kb': baseline,
+        'peak_kb': instrumentation.peak_memory_kb(),
+        'message_bytes': message_bytes
+    }
+
+
+def serve_smtp():
+    bench_smtp.start_server()
+    while True:
+        time.sleep(1)
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        print(json.dumps(run_child(int(sys.argv[2]))))
+        return
+
+    server = multiprocessing.Process(target=serve_smtp)
+    server.daemon = True
+    server.start()
+    scales = [int(s) for s in sys.argv[1:]] or SCALES
+    print('{:>8} {:>14} {:>14} {:>14}'.format(
+        'issues', 'peak memory', 'above start', 'message'
+    ))
+    for scale in scales:
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--child', str(scale)]
+        )
+        result = json.loads(output.splitlines()[-1])
+        print('{:>8} {:>11} KB {:>11} KB {:>12} B'.format(
+            scale,
+            result['peak_kb'],
+            result['peak_kb'] - result['baseline_kb'],
+            result['message_bytes']
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Measures email delivery throughput against a local SMTP stand-in,
+comparing a new connection per message with one shared SMTPSession.
+
+    python benchmarks/bench_smtp.py [messages]
+'''
+import asyncore
+import os
+import smtpd
+import sys
+import threading
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import delivery
+
+
+HOST = '127.0.0.1'
+PORT = 8025
+
+
+class DiscardingServer(smtpd.SMTPServer):
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        pass
+
+
+def start_server():
+    DiscardingServer((HOST, PORT), None)
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+
+
+def make_message(i):
+    message = MIMEText('<p>digest {}</p>'.format(i) * 200, 'html')
+    message['Subject'] = 'Jira Digest'
+    return message
+
+
+def time_connection_per_message(messages):
+    start = time.time()
+    for message in messages:
+        with delivery.SMTPSession(None, None, HOST, PORT) as smtp:
+            smtp.send('bench@localhost', 'bench@localhost', message)
+    return time.time() - start
+
+
+def time_session(messages):
+    start = time.time()
+    with delivery.SMTPSession(None, None, HOST, PORT) as smtp:
+        smtp.send_batch(
+            ('bench@localhost', 'bench@localhost', message)
+            for message in messages
+        )
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    start_server()
+    messages = [make_message(i) for i in range(count)]
+    for name, bench in [
+        ('connection per message', time_connection_per_message),
+        ('shared session', time_session)
+    ]:
+        seconds = bench(messages)
+        print('{:<24} {:>8.3f}s {:>10.1f} messages/s'.format(
+            name,
+            seconds,
+            count / seconds
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Times jira_digest.sort_summaries on a single issue with a growing
+number of changelog summaries. The time per summary should stay flat
+as the history grows.
+
+    python benchmarks/bench_sort_summaries.py
+'''
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'jira', 'jira_digest'
+))
+import jira_digest
+
+
+FIELDS = [
+    'Issue Created',
+    'Comment',
+    'Assignee',
+    'Labels',
+    'Link',
+] + jira_digest.CHANGELOG_CONSOLIDATE + jira_digest.CHANGELOG_TRUNCATE
+HISTORY_LENGTHS = [10, 100, 1000, 10000, 100000]
+
+
+def make_summaries(length):
+    return [
+        jira_digest.Summary(
+            field=random.choice(FIELDS),
+            author='author {}'.format(i % 7),
+            fromStr='old {}'.format(i),
+            toStr='new {}'.format(i)
+        ) for i in range(length)
+    ]
+
+
+def time_sort(summaries, repeat=3):
+    def run():
+        jira_digest.sort_summaries({'HIG-1': list(summaries)})
+    number = max(1, 100000 // len(summaries))
+    return min(timeit.repeat(run, number=number, repeat=repeat)) / number
+
+
+def main():
+    random.seed(0)
+    print('{:>10} {:>14} {:>16}'.format('summaries', 'seconds', 'usec/summary'))
+    for length in HISTORY_LENGTHS:
+        seconds = time_sort(make_summaries(length))
+        print('{:>10} {:>14.6f} {:>16.3f}'.format(
+            length,
+            seconds,
+            seconds / length * 1e6
+        ))
+
+
+if __name__ == '__main__':
+    main()
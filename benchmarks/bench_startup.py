@@ -0,0 +1,182 @@
+'''
+Measures how long each script takes to start, and which imports that
+time goes to.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --imports jira_digest
+    python benchmarks/bench_startup.py --output startup.json
+    python benchmarks/bench_startup.py --compare startup.json
+
+Each script is run with --help in a new interpreter, which is what a
+cron job pays before doing any work. --imports lists the modules a
+script imports before exiting, slowest first, with the time spent in
+each module itself and including the modules it imports, much like
+-X importtime on Python 3.
+'''
+import argparse
+from collections import OrderedDict
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPTS = OrderedDict([
+    ('jira_digest', os.path.join('jira', 'jira_digest', 'jira_digest.py')),
+    ('team_update', os.path.join('jira', 'team_update.py')),
+    ('long_reviews', os.path.join('phabricator', 'long_reviews.py')),
+    ('review_digest', os.path.join('phabricator', 'review_digest.py')),
+    ('reviews_with_tests', os.path.join('phabricator', 'reviews_with_tests.py')),
+])
+
+# Run in the child interpreter: times every first import of a module,
+# then runs the script with --help and prints the timings as JSON
+IMPORT_TIMER = '''
+import __builtin__, json, os, runpy, sys, time
+timings = []
+stack = []
+original_import = __builtin__.__import__
+
+def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    if name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+    stack.append(0.0)
+    start = time.time()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = time.time() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += cumulative
+        timings.append((name, cumulative - nested, cumulative))
+
+__builtin__.__import__ = timed_import
+sys.argv = [sys.argv[1], '--help']
+sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+__builtin__.__import__ = original_import
+sys.stderr.write(json.dumps(timings))
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the startup time of each script.'
+    )
+    parser.add_argument(
+        '--scripts',
+        nargs='+',
+        choices=list(SCRIPTS),
+        default=list(SCRIPTS),
+        help='scripts to measure (default: all)'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='runs of each script to take the fastest of (default: 5)'
+    )
+    parser.add_argument(
+        '--imports',
+        choices=list(SCRIPTS),
+        help='list the imports of this script, slowest first'
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=25,
+        help='most imports to list (default: 25)'
+    )
+    parser.add_argument('--output', help='file to write JSON results to')
+    parser.add_argument('--compare', help='JSON results file to compare with')
+    return parser.parse_args()
+
+
+def time_startup(script, repeat):
+    '''Returns the fastest wall time of running the script with --help
+    '''
+    path = os.path.join(REPO_DIR, SCRIPTS[script])
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.call(
+                [sys.executable, path, '--help'],
+                stdout=devnull,
+                stderr=devnull
+            )
+            times.append(time.time() - start)
+    return min(times)
+
+
+def time_imports(script):
+    '''Returns (module, self seconds, cumulative seconds) for each import
+    '''
+    path = os.path.join(REPO_DIR, SCRIPTS[script])
+    child = subprocess.Popen(
+        [sys.executable, '-c', IMPORT_TIMER, path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    _, errors = child.communicate()
+    return json.loads(errors.splitlines()[-1])
+
+
+def print_imports(script, top):
+    timings = sorted(time_imports(script), key=lambda t: -t[2])
+    print('{:>10} {:>12}  {}'.format('self ms', 'cumulative', 'module'))
+    for name, own, cumulative in timings[:top]:
+        print('{:>10.1f} {:>10.1f}ms  {}'.format(own * 1000, cumulative * 1000, name))
+
+
+def main():
+    args = parse_args()
+    if args.imports:
+        print_imports(args.imports, args.top)
+        return
+
+    baseline = time_startup_of_interpreter(args.repeat)
+    print('{:<20} {:>10} {:>14}'.format('script', 'seconds', 'over python'))
+    results = OrderedDict()
+    for script in args.scripts:
+        seconds = time_startup(script, args.repeat)
+        results[script] = seconds
+        print('{:<20} {:>9.3f}s {:>13.3f}s'.format(script, seconds, seconds - baseline))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(OrderedDict([
+                ('python', sys.version.split()[0]),
+                ('interpreter', baseline),
+                ('results', results)
+            ]), output, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as base_file:
+            base = json.load(base_file)['results']
+        print('\n{:<20} {:>10} {:>10} {:>8}'.format('script', 'base', 'current', 'ratio'))
+        for script, seconds in results.items():
+            if script in base:
+                print('{:<20} {:>9.3f}s {:>9.3f}s {:>7.2f}x'.format(
+                    script, base[script], seconds, seconds / base[script]
+                ))
+
+
+def time_startup_of_interpreter(repeat):
+    '''Returns the fastest wall time of starting Python and exiting
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.call([sys.executable, '-c', 'pass'])
+        times.append(time.time() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+'''
+Generators of realistic fake JIRA issues and Phabricator revisions, so
+the report pipelines can be benchmarked offline. Every generator takes
+a seed and returns the same data for the same arguments.
+'''
+import datetime
+import os
+import random
+import sys
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for path in ['jira/jira_digest', 'jira', 'phabricator']:
+    sys.path.insert(0, os.path.join(REPO_DIR, path))
+from issue_store import to_record
+
+
+USERS = ['user{}'.format(i) for i in range(50)]
+COMPONENTS = ['Backend', 'Query API', 'Import', 'Frontend', 'Docs']
+ISSUE_TYPES = ['Bug', 'Story', 'Task', 'Epic', 'Sub-task', 'Improvement']
+PRIORITIES = ['Blocker', 'Critical', 'Major', 'Minor', 'Trivial']
+STATUSES = ['Open', 'In Progress', 'In Review', 'Resolved', 'Closed']
+CHANGELOG_FIELDS = [
+    'status', 'priority', 'assignee', 'labels', 'Component', 'Fix Version',
+    'description', 'summary', 'Rank', 'Sprint', 'Story Points', 'Link'
+]
+WORDS = (
+    'query import backend frontend crash slow timeout table column filter '
+    'cluster node retry cache index merge the a of to in for with when on'
+).split()
+
+
+def jira_time(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime(
+        '%Y-%m-%dT%H:%M:%S.000+0000'
+    )
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def jira_user(name):
+    return {'key': name, 'name': name, 'displayName': name.title()}
+
+
+def fake_jira_issues(count, histories=5, comments=2, hours=24, seed=0):
+    '''
+    Returns count issues with the attribute layout of jira Issue
+    resources fetched with the changelog expanded
+    '''
+    return [
+        to_record(raw)
+        for raw in fake_jira_issue_dicts(count, histories, comments, hours, seed)
+    ]
+
+
+def fake_jira_issue_dicts(count, histories=5, comments=2, hours=24, seed=0):
+    '''
+    Returns count raw issues as returned by the JIRA search API with
+    the changelog expanded
+    '''
+    return list(iter_fake_jira_issue_dicts(count, histories, comments, hours, seed))
+
+
+def iter_fake_jira_issue_dicts(count, histories=5, comments=2, hours=24, seed=0):
+    '''
+    Yields count raw issues one at a time. Each issue has about
+    histories changelog entries and comments comments, spread over
+    twice the hours window so some fall outside it.
+    '''
+    rng = random.Random(seed)
+    now = time.time()
+    span = hours * 3600 * 2
+    for i in range(count):
+        created = now - rng.uniform(0, span)
+        entries = []
+        for j in range(rng.randint(0, histories * 2)):
+            entries.append({
+                'id': str(j),
+                'created': jira_time(rng.uniform(created, now)),
+                'author': jira_user(rng.choice(USERS)),
+                'items': [{
+                    'field': rng.choice(CHANGELOG_FIELDS),
+                    'fromString': text(rng, 3),
+                    'toString': text(rng, 3)
+                } for _ in range(rng.randint(1, 3))]
+            })
+        # JIRA returns changelogs oldest first
+        entries.sort(key=lambda entry: entry['created'])
+        for j, entry in enumerate(entries):
+            entry['id'] = str(j)
+        issue_comments = []
+        for j in range(rng.randint(0, comments * 2)):
+            comment_created = rng.uniform(created, now)
+            issue_comments.append({
+                'id': str(j),
+                'created': jira_time(comment_created),
+                'updated': jira_time(rng.uniform(comment_created, now)),
+                'author': jira_user(rng.choice(USERS)),
+                'body': text(rng, rng.randint(5, 80))
+            })
+        yield {
+            'id': str(10000 + i),
+            'key': 'HIG-{}'.format(i),
+            'fields': {
+                'summary': text(rng, 8),
+                'description': text(rng, rng.randint(10, 200)),
+                'created': jira_time(created),
+                'updated': jira_time(now),
+                'issuetype': {'name': rng.choice(ISSUE_TYPES)},
+                'priority': {'name': rng.choice(PRIORITIES)},
+                'status': {'name': rng.choice(STATUSES)},
+                'reporter': jira_user(rng.choice(USERS)),
+                'assignee': jira_user(rng.choice(USERS)),
+                'components': [{'name': rng.choice(COMPONENTS)}],
+                'comment': {'comments': issue_comments}
+            },
+            'changelog': {'histories': entries}
+        }
+
+
+def fake_watchers(issue_key, max_watchers=3):
+    '''Returns the same few JIRA users for the same issue key
+    '''
+    rng = random.Random(issue_key)
+    return [
+        jira_user(rng.choice(USERS))
+        for _ in range(rng.randint(0, max_watchers))
+    ]
+
+
+def fake_commit_paths(revision_id, max_paths=20):
+    '''Returns the same changed paths for the same revision id
+    '''
+    rng = random.Random(int(revision_id))
+    paths = []
+    for _ in range(rng.randint(1, max_paths)):
+        directory = rng.choice(['backend', 'frontend', 'import', 'tests'])
+        paths.append('{}/{}_{}.py'.format(
+            directory,
+            rng.choice(WORDS),
+            rng.choice(['', 'test', 'util'])
+        ))
+    return paths
+
+
+def fake_sprint_strings(rng, sprints):
+    '''
+    Returns the sprint field values of sprints sprints, the last of
+    them active, in the format the JIRA API returns them
+    '''
+    return [
+        'com.atlassian.greenhopper.service.sprint.Sprint@{0:x}[id={1},'
+        'rapidViewId=1,state={2},name=Sprint {1},goal=,'
+        'startDate=2016-01-01T00:00:00.000Z]'.format(
+            rng.getrandbits(32), i, 'ACTIVE' if i == sprints - 1 else 'CLOSED'
+        ) for i in range(sprints)
+    ]
+
+
+def fake_sprint_issues(count, sprints=4, seed=0):
+    '''
+    Returns count issues in open sprints with the fields requested by
+    team_update
+    '''
+    rng = random.Random(seed)
+    sprint_strings = fake_sprint_strings(rng, sprints)
+    return [to_record({
+        'key': 'HIG-{}'.format(i),
+        'fields': {
+            'summary': text(rng, 8),
+            'status': {'name': rng.choice(
+                ['In Progress', 'In Review', 'Resolved', 'Closed']
+            )},
+            'components': [{'name': rng.choice(COMPONENTS)}],
+            'customfield_10007': sprint_strings[rng.randint(0, sprints - 1):]
+        }
+    }) for i in range(count)]
+
+
+def fake_revisions(count, authors, max_diffs=10, days=30, seed=0):
+    '''
+    Returns count differential.query results by the provided author
+    PHIDs, each with between 1 and max_diffs diffs, created over the
+    past days days and sorted newest first
+    '''
+    rng = random.Random(seed)
+    now = time.time()
+    revisions = []
+    for i in range(count):
+        created = now - rng.uniform(0, days * 24 * 3600)
+        revisions.append({
+            'id': str(i),
+            'uri': 'https://phabricator.example.com/D{}'.format(i),
+            'title': text(rng, 8),
+            'authorPHID': rng.choice(authors),
+            'dateCreated': str(int(created)),
+            'dateModified': str(int(rng.uniform(created, now))),
+            'statusName': rng.choice(
+                ['Needs Review', 'Accepted', 'Needs Revision',
+                 'Closed', 'Abandoned']
+            ),
+            'diffs': [str(d) for d in range(rng.randint(1, max_diffs))]
+        })
+    revisions.sort(key=lambda r: -int(r['dateCreated']))
+    return revisions
+
+
+class FakeResponse(object):
+    def __init__(self, response):
+        self.response = response
+
+
+class FakeDifferential(object):
+    '''Answers differential.query from a list of revisions
+    '''
+    def __init__(self, revisions):
+        self.revisions = revisions
+
+    def query(self, authors=None, ids=None, status=None, order=None,
+              limit=None, offset=0, **constraints):
+        ids = set(str(i) for i in ids) if ids else None
+        reviews = [
+            r for r in self.revisions
+            if (authors is None or r['authorPHID'] in authors)
+            and (ids is None or r['id'] in ids)
+            and (status != 'status-open'
+                 or r['statusName'] not in ('Closed', 'Abandoned'))
+        ]
+        if order == 'order-modified':
+            reviews.sort(key=lambda r: -int(r['dateModified']))
+        end = offset + limit if limit else None
+        return [dict(r) for r in reviews[offset:end]]
+
+
+class FakeUser(object):
+    def __init__(self, aliases_to_user_ids):
+        self.aliases_to_user_ids = aliases_to_user_ids
+
+    def find(self, aliases):
+        # Like Conduit, an empty result is an empty list
+        return FakeResponse({
+            a: self.aliases_to_user_ids[a]
+            for a in aliases if a in self.aliases_to_user_ids
+        } or [])
+
+
+class FakePhabricator(object):
+    '''Offline stand-in for the phabricator.Phabricator client
+    '''
+    def __init__(self, revisions, aliases_to_user_ids):
+        self.differential = FakeDifferential(revisions)
+        self.user = FakeUser(aliases_to_user_ids)
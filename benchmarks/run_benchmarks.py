@@ -0,0 +1,292 @@
+'''
+Times each stage of the report pipelines on generated data, offline.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --scales 100 10000 --compare results.json
+
+Results are written as JSON so runs on different commits can be
+compared with --compare.
+'''
+import argparse
+from collections import OrderedDict
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import fake_data
+from fake_data import REPO_DIR
+
+sys.path.insert(0, REPO_DIR)
+from common import rendering
+import jira_digest
+import long_reviews
+import review_digest
+import team_update
+
+
+SCALES = [10 ** 2, 10 ** 4, 10 ** 5]
+DIGEST_USER = 'user0'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the report pipelines on generated data.'
+    )
+    parser.add_argument(
+        '--scales',
+        type=int,
+        nargs='+',
+        default=SCALES,
+        help='numbers of issues or revisions to generate (default: {})'.format(
+            ' '.join(str(s) for s in SCALES)
+        )
+    )
+    parser.add_argument(
+        '--pipelines',
+        nargs='+',
+        choices=list(PIPELINES),
+        default=list(PIPELINES),
+        help='pipelines to benchmark (default: all)'
+    )
+    parser.add_argument(
+        '--histories',
+        type=int,
+        default=5,
+        help='average changelog entries per JIRA issue (default: 5)'
+    )
+    parser.add_argument(
+        '--comments',
+        type=int,
+        default=2,
+        help='average comments per JIRA issue (default: 2)'
+    )
+    parser.add_argument(
+        '--max-diffs',
+        type=int,
+        default=10,
+        help='most diffs per Phabricator revision (default: 10)'
+    )
+    parser.add_argument('--output', help='file to write JSON results to')
+    parser.add_argument('--compare', help='JSON results file to compare with')
+    return parser.parse_args()
+
+
+def time_stage(function, scale):
+    '''
+    Returns the fastest of several runs of function in seconds, with
+    fewer runs at larger scales
+    '''
+    repeat = 5 if scale <= 1000 else 1
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def bench_jira_digest(scale, args):
+    issues = fake_data.fake_jira_issues(
+        scale,
+        histories=args.histories,
+        comments=args.comments
+    )
+    digest_args = jira_digest.parse_args([
+        '--user', DIGEST_USER,
+        '--email', 'digest@example.com'
+    ])
+    state = {}
+
+    def transform():
+        state['events'] = jira_digest.get_issue_events(issues, digest_args)
+
+    def slice_window():
+        state['window_events'] = jira_digest.slice_window(
+            state['events'],
+            digest_args.windows[0]
+        )
+
+    def summarize():
+        state['summaries'] = jira_digest.summarize_for_user(
+            state['window_events'],
+            DIGEST_USER
+        )
+
+    def render():
+        with open(os.devnull, 'w') as output:
+            jira_digest.write_quoted_printable(output, rendering.generate_encoded(
+                'email.html',
+                summarized_issues=state['summaries'],
+                args=digest_args
+            ))
+
+    def mime():
+        spool_size = jira_digest.SPOOL_SIZE
+        with tempfile.SpooledTemporaryFile(max_size=spool_size) as message:
+            jira_digest.write_message(message, state['summaries'], digest_args)
+
+    return [
+        ('transform', transform),
+        ('slice', slice_window),
+        ('summarize', summarize),
+        ('render', render),
+        ('mime', mime)
+    ]
+
+
+def bench_team_update(scale, args):
+    issues = fake_data.fake_sprint_issues(scale)
+    state = {}
+
+    def transform():
+        team_update._sprints.clear()
+        state['jira_info'] = team_update.sort_by_sprint(issues)
+
+    def render():
+        rendering.render('team_update.html', jira_info=state['jira_info'])
+
+    return [('transform', transform), ('render', render)]
+
+
+def fake_phabricator(aliases, scale, args):
+    aliases_to_user_ids = OrderedDict(
+        (alias, 'PHID-USER-{}'.format(alias)) for alias in aliases
+    )
+    revisions = fake_data.fake_revisions(
+        scale,
+        aliases_to_user_ids.values(),
+        max_diffs=args.max_diffs
+    )
+    return fake_data.FakePhabricator(revisions, aliases_to_user_ids), aliases_to_user_ids
+
+
+def bench_long_reviews(scale, args):
+    phab, aliases_to_user_ids = fake_phabricator(long_reviews.ALIASES, scale, args)
+    snapshot = long_reviews.ReviewSnapshot(path=None)
+    state = {}
+
+    def fetch():
+        state['reviews'] = long_reviews.find_long_reviews(phab, aliases_to_user_ids)
+
+    def refresh():
+        # Nothing has been modified since the snapshot was first filled
+        state['reviews'] = long_reviews.find_long_reviews(
+            phab,
+            aliases_to_user_ids,
+            snapshot
+        )
+
+    def transform():
+        state['users_to_reviews'] = long_reviews.map_users_to_reviews(
+            aliases_to_user_ids,
+            state['reviews']
+        )
+
+    def render():
+        rendering.render(
+            'long_reviews.html',
+            users_to_reviews=state['users_to_reviews']
+        )
+
+    snapshot.update(phab, aliases_to_user_ids.values())
+    return [
+        ('fetch', fetch),
+        ('refresh', refresh),
+        ('transform', transform),
+        ('render', render)
+    ]
+
+
+def bench_review_digest(scale, args):
+    phab, aliases_to_user_ids = fake_phabricator(review_digest.ALIASES, scale, args)
+    state = {}
+
+    def fetch():
+        state['users_to_reviews'] = review_digest.find_reviews(
+            phab,
+            aliases_to_user_ids
+        )
+
+    def render():
+        rendering.render(
+            'review_digest.html',
+            users_to_reviews=state['users_to_reviews']
+        )
+
+    return [('fetch', fetch), ('render', render)]
+
+
+PIPELINES = OrderedDict([
+    ('jira_digest', bench_jira_digest),
+    ('team_update', bench_team_update),
+    ('long_reviews', bench_long_reviews),
+    ('review_digest', bench_review_digest),
+])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=REPO_DIR
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    for pipeline in args.pipelines:
+        for scale in args.scales:
+            for stage, function in PIPELINES[pipeline](scale, args):
+                seconds = time_stage(function, scale)
+                results.append(OrderedDict([
+                    ('pipeline', pipeline),
+                    ('stage', stage),
+                    ('scale', scale),
+                    ('seconds', seconds)
+                ]))
+                print('{:<14} {:<10} {:>8} {:>12.6f}s'.format(
+                    pipeline, stage, scale, seconds
+                ))
+    return results
+
+
+def compare(base_results, results):
+    '''Prints each stage's time relative to the same stage in base_results
+    '''
+    base = {
+        (r['pipeline'], r['stage'], r['scale']): r['seconds']
+        for r in base_results
+    }
+    print('\n{:<14} {:<10} {:>8} {:>12} {:>12} {:>8}'.format(
+        'pipeline', 'stage', 'scale', 'base', 'current', 'ratio'
+    ))
+    for r in results:
+        key = (r['pipeline'], r['stage'], r['scale'])
+        if key in base:
+            print('{:<14} {:<10} {:>8} {:>11.6f}s {:>11.6f}s {:>7.2f}x'.format(
+                r['pipeline'], r['stage'], r['scale'],
+                base[key], r['seconds'],
+                r['seconds'] / base[key] if base[key] else float('inf')
+            ))
+
+
+def main():
+    args = parse_args()
+    results = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(OrderedDict([
+                ('commit', git_commit()),
+                ('python', platform.python_version()),
+                ('results', results)
+            ]), output, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as base_file:
+            compare(json.load(base_file)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,708 @@
+'''
+Local stand-ins for the JIRA REST API and Phabricator's Conduit API, so
+the scripts can be load tested end to end on one machine.
+
+    python benchmarks/stand_in_servers.py --issues 10000 --revisions 10000 \\
+        --latency 50 --error-rate 0.01 --rate-limit 100
+
+The JIRA stand-in answers the serverInfo, myself, field, search, issue
+watchers and issue changelog resources, evaluating the JQL the scripts
+send. Its user's time zone is UTC.
+Point JIRA_URL at http://localhost:8080 and leave JIRA_KEY_CERT empty
+to connect without OAuth.
+
+The Conduit stand-in answers user.find, differential.query and
+differential.getcommitpaths. Add http://localhost:8081/api/ to the
+hosts in ~/.arcrc with any token and make it the default host. The
+generated revisions are written by the --authors aliases.
+
+Every request waits --latency milliseconds, plus up to --jitter more,
+before it is answered. With --error-rate a share of requests fail with
+--error-status, and with --rate-limit requests beyond that many per
+second are refused with 429. Request counts are printed on exit.
+'''
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import calendar
+from collections import Counter
+import json
+import random
+import re
+from SocketServer import ThreadingMixIn
+import threading
+import time
+import urlparse
+
+import fake_data
+from jira_time import parse_jira_time
+
+
+JIRA_PORT = 8080
+CONDUIT_PORT = 8081
+SPRINT_FIELD = 'customfield_10007'
+JIRA_FIELD_LIST = [
+    {'id': 'summary', 'name': 'Summary', 'clauseNames': ['summary']},
+    {'id': 'status', 'name': 'Status', 'clauseNames': ['status']},
+    {'id': 'components', 'name': 'Component/s', 'clauseNames': ['component']},
+    {'id': 'resolutiondate', 'name': 'Resolved',
+     'clauseNames': ['resolutiondate', 'resolved']},
+    {'id': SPRINT_FIELD, 'name': 'Sprint',
+     'clauseNames': ['Sprint', 'cf[10007]']},
+]
+TIME_UNITS = {'m': 60, 'h': 3600, 'd': 24 * 3600, 'w': 7 * 24 * 3600}
+JQL_TOKEN_PATTERN = re.compile(
+    r'\s*("[^"]*"|\'[^\']*\'|>=|<=|!=|[()=<>,~]|[^\s()=<>!,~"\']+)'
+)
+ORDER_BY_PATTERN = re.compile(r'\border\s+by\b.*$', re.IGNORECASE)
+ISSUE_KEY_PATTERN = re.compile(r'/[A-Z][A-Z0-9]*-\d+/')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Serve generated data over the JIRA and Conduit APIs.'
+    )
+    parser.add_argument(
+        '--issues',
+        type=int,
+        default=1000,
+        help='number of JIRA issues to generate (default: 1000)'
+    )
+    parser.add_argument(
+        '--histories',
+        type=int,
+        default=5,
+        help='average changelog entries per JIRA issue (default: 5)'
+    )
+    parser.add_argument(
+        '--comments',
+        type=int,
+        default=2,
+        help='average comments per JIRA issue (default: 2)'
+    )
+    parser.add_argument(
+        '--hours',
+        type=int,
+        default=24,
+        help='issue activity spans twice this many hours (default: 24)'
+    )
+    parser.add_argument(
+        '--revisions',
+        type=int,
+        default=1000,
+        help='number of Phabricator revisions to generate (default: 1000)'
+    )
+    parser.add_argument(
+        '--max-diffs',
+        type=int,
+        default=10,
+        help='most diffs per Phabricator revision (default: 10)'
+    )
+    parser.add_argument(
+        '--authors',
+        nargs='+',
+        default=fake_data.USERS,
+        help='aliases that write the generated revisions (default: user0..user49)'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--jira-port', type=int, default=JIRA_PORT)
+    parser.add_argument('--conduit-port', type=int, default=CONDUIT_PORT)
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='milliseconds to wait before each response (default: 0)'
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0,
+        help='up to this many more milliseconds to wait (default: 0)'
+    )
+    parser.add_argument(
+        '--error-rate',
+        type=float,
+        default=0,
+        help='share of requests to fail, between 0 and 1 (default: 0)'
+    )
+    parser.add_argument(
+        '--error-status',
+        type=int,
+        default=500,
+        help='HTTP status of failed requests; the JIRA client retries 502, '
+             '503 and 504 (default: 500)'
+    )
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        help='requests per second each server accepts before answering 429'
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='log every request'
+    )
+    return parser.parse_args()
+
+
+class RateLimiter(object):
+    '''Token bucket allowing rate requests per second in bursts of rate
+    '''
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(
+                self.rate,
+                self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, dataset, args):
+        HTTPServer.__init__(self, address, handler_class)
+        self.dataset = dataset
+        self.args = args
+        self.rate_limiter = RateLimiter(args.rate_limit) if args.rate_limit else None
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''
+    Adds latency, injected errors and rate limiting to every request
+    before handing it to route(), which returns a status and JSON body
+    '''
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response so its headers and body go out in one write,
+    # rather than waiting out delayed ACKs between small writes
+    wbufsize = -1
+
+    def handle_request(self):
+        server = self.server
+        args = server.args
+        path = urlparse.urlparse(self.path).path
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else ''
+        server.count('requests')
+
+        delay = args.latency + random.uniform(0, args.jitter)
+        if delay:
+            time.sleep(delay / 1000.0)
+
+        if server.rate_limiter and not server.rate_limiter.acquire():
+            server.count('throttled')
+            self.respond(429, {'errorMessages': ['Rate limit exceeded']},
+                         {'Retry-After': '1'})
+            return
+        if args.error_rate and random.random() < args.error_rate:
+            server.count('errors')
+            self.respond(args.error_status, {'errorMessages': ['Injected error']})
+            return
+
+        try:
+            status, body = self.route(path)
+        except Exception as e:
+            server.count('exceptions')
+            status, body = 500, {'errorMessages': [repr(e)]}
+        server.count('{} {}'.format(
+            self.command,
+            ISSUE_KEY_PATTERN.sub('/{key}/', path)
+        ))
+        self.respond(status, body)
+
+    def respond(self, status, body, headers=None):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def query_params(self):
+        '''Returns the query string, with repeated parameters as lists
+        '''
+        query = urlparse.urlparse(self.path).query
+        return urlparse.parse_qs(query, keep_blank_values=True)
+
+    def read_form(self):
+        return urlparse.parse_qs(self.body, keep_blank_values=True)
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def first(params, name, default=None):
+    return params[name][0] if name in params else default
+
+
+def split_list(params, name):
+    '''Returns a comma separated or repeated query parameter as a list
+    '''
+    return [
+        item.strip()
+        for value in params.get(name, [])
+        for item in value.split(',') if item.strip()
+    ]
+
+
+class JiraDataset(object):
+    '''Generated issues with the values JQL clauses compare against
+    '''
+    def __init__(self, issues, seed=0):
+        rng = random.Random(seed)
+        sprint_strings = fake_data.fake_sprint_strings(rng, 4)
+        self.issues = issues
+        self.by_key = {}
+        self.watchers = {}
+        self.values = {}
+        for issue in issues:
+            fields = issue['fields']
+            fields[SPRINT_FIELD] = sprint_strings[rng.randint(0, len(sprint_strings) - 1):]
+            fields['resolutiondate'] = None
+            if fields['status']['name'] in ('Resolved', 'Closed'):
+                fields['resolutiondate'] = fields['updated']
+            key = issue['key']
+            self.by_key[key] = issue
+            self.watchers[key] = fake_data.fake_watchers(key)
+            self.values[key] = self.searchable_values(issue)
+
+    def searchable_values(self, issue):
+        fields = issue['fields']
+        key = issue['key']
+        return {
+            'key': [key],
+            'project': [key.split('-')[0]],
+            'component': [c['name'] for c in fields['components']],
+            'status': [fields['status']['name']],
+            'assignee': user_names(fields['assignee']),
+            'reporter': user_names(fields['reporter']),
+            'watcher': [n for w in self.watchers[key] for n in user_names(w)],
+            'created': parse_jira_time(fields['created']),
+            'updated': parse_jira_time(fields['updated']),
+            'resolutiondate': (parse_jira_time(fields['resolutiondate'])
+                               if fields['resolutiondate'] else None),
+        }
+
+    def search(self, jql):
+        matches = parse_jql(jql)
+        return [i for i in self.issues if matches(self.values[i['key']])]
+
+
+def user_names(user):
+    if not user:
+        return []
+    return [user['key'], user['name']]
+
+
+class JiraHandler(StandInHandler):
+    '''Answers the JIRA REST resources the jira client uses
+    '''
+    ISSUE_PATTERN = re.compile(r'^/rest/api/2/issue/([^/]+)/(watchers|changelog)$')
+
+    def do_GET(self):
+        self.handle_request()
+
+    def route(self, path):
+        dataset = self.server.dataset
+        params = self.query_params()
+        if path == '/rest/api/2/serverInfo':
+            return 200, {
+                'baseUrl': 'http://{}:{}'.format(*self.server.server_address),
+                'version': '7.0.0',
+                'versionNumbers': [7, 0, 0],
+                'deploymentType': 'Server'
+            }
+        if path == '/rest/api/2/myself':
+            return 200, {'name': 'stand-in', 'timeZone': 'UTC'}
+        if path == '/rest/api/2/field':
+            return 200, JIRA_FIELD_LIST
+        if path == '/rest/api/2/search':
+            return self.search(dataset, params)
+        match = self.ISSUE_PATTERN.match(path)
+        if match:
+            key, resource = match.groups()
+            if key not in dataset.by_key:
+                return 404, {'errorMessages': ['Issue Does Not Exist']}
+            if resource == 'watchers':
+                watchers = dataset.watchers[key]
+                return 200, {
+                    'isWatching': False,
+                    'watchCount': len(watchers),
+                    'watchers': watchers
+                }
+            return 200, page(
+                dataset.by_key[key]['changelog']['histories'],
+                params,
+                'values'
+            )
+        return 404, {'errorMessages': ['No stand-in for ' + path]}
+
+    def search(self, dataset, params):
+        try:
+            issues = dataset.search(first(params, 'jql', ''))
+        except ValueError as e:
+            return 400, {'errorMessages': [str(e)]}
+        result = page(issues, params, 'issues')
+        fields = split_list(params, 'fields')
+        expand = split_list(params, 'expand')
+        result['issues'] = [
+            select_fields(issue, fields, 'changelog' in expand)
+            for issue in result['issues']
+        ]
+        return 200, result
+
+
+def page(items, params, items_key):
+    start_at = int(first(params, 'startAt', 0))
+    max_results = int(first(params, 'maxResults', 50))
+    values = items[start_at:start_at + max_results]
+    return {
+        'startAt': start_at,
+        'maxResults': max_results,
+        'total': len(items),
+        'isLast': start_at + len(values) >= len(items),
+        items_key: values
+    }
+
+
+def select_fields(issue, fields, changelog):
+    result = {
+        'id': issue['id'],
+        'key': issue['key'],
+        'fields': issue['fields']
+    }
+    if fields and '*all' not in fields and '*navigable' not in fields:
+        result['fields'] = {
+            f: v for f, v in issue['fields'].iteritems() if f in fields
+        }
+    if changelog:
+        histories = issue['changelog']['histories']
+        result['changelog'] = {
+            'startAt': 0,
+            'maxResults': len(histories),
+            'total': len(histories),
+            'histories': histories
+        }
+    return result
+
+
+def parse_jql(jql):
+    '''
+    Returns a predicate for the issue values matching jql. Clauses on
+    fields the stand-in does not know, and functions such as
+    openSprints(), match every issue.
+    '''
+    jql = ORDER_BY_PATTERN.sub('', jql)
+    tokens = JQL_TOKEN_PATTERN.findall(jql)
+    if ''.join(tokens).replace(' ', '') != re.sub(r'\s', '', jql):
+        raise ValueError('Cannot parse JQL: {}'.format(jql))
+    if not tokens:
+        return lambda values: True
+    parser = JqlParser(tokens)
+    matches = parser.expression()
+    if parser.position != len(tokens):
+        raise ValueError('Unexpected {!r} in JQL'.format(tokens[parser.position]))
+    return matches
+
+
+class JqlParser(object):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected and token.lower() != expected):
+            raise ValueError('Expected {} in JQL, found {!r}'.format(
+                expected or 'more', token
+            ))
+        self.position += 1
+        return token
+
+    def expression(self):
+        terms = [self.term()]
+        while (self.peek() or '').lower() == 'or':
+            self.take()
+            terms.append(self.term())
+        return lambda values: any(t(values) for t in terms)
+
+    def term(self):
+        factors = [self.factor()]
+        while (self.peek() or '').lower() == 'and':
+            self.take()
+            factors.append(self.factor())
+        return lambda values: all(f(values) for f in factors)
+
+    def factor(self):
+        token = self.peek()
+        if token is not None and token.lower() == 'not':
+            self.take()
+            negated = self.factor()
+            return lambda values: not negated(values)
+        if token == '(':
+            self.take()
+            expression = self.expression()
+            self.take(')')
+            return expression
+        return self.clause()
+
+    def clause(self):
+        field = unquote(self.take()).lower()
+        operator = self.take().lower()
+        if operator in ('not', 'is') and (self.peek() or '').lower() in ('in', 'not'):
+            operator = '{} {}'.format(operator, self.take().lower())
+        operand = self.operand()
+        return clause_predicate(field, operator, operand)
+
+    def operand(self):
+        '''Returns a list of values, or None for a function call
+        '''
+        if self.peek() == '(':
+            self.take()
+            values = []
+            while self.peek() != ')':
+                values.extend(self.operand() or [])
+                if self.peek() == ',':
+                    self.take()
+            self.take(')')
+            return values
+        value = self.take()
+        if self.peek() == '(':
+            self.take()
+            self.take(')')
+            return None
+        return [unquote(value)]
+
+
+def unquote(token):
+    if len(token) > 1 and token[0] in '"\'' and token[-1] == token[0]:
+        return token[1:-1]
+    return token
+
+
+def clause_predicate(field, operator, operand):
+    if operand is None or field not in ('key', 'project', 'component',
+                                        'status', 'assignee', 'reporter',
+                                        'watcher', 'created', 'updated',
+                                        'resolutiondate', 'resolved'):
+        return lambda values: True
+    if field == 'resolved':
+        field = 'resolutiondate'
+
+    if field in ('created', 'updated', 'resolutiondate'):
+        if operator in ('is', 'is not'):
+            empty = operator == 'is'
+            return lambda values: (values[field] is None) == empty
+        limit = jql_time(operand[0])
+        compare = {
+            '>': lambda a, b: a > b,
+            '>=': lambda a, b: a >= b,
+            '<': lambda a, b: a < b,
+            '<=': lambda a, b: a <= b,
+            '=': lambda a, b: a == b,
+            '!=': lambda a, b: a != b,
+        }[operator]
+        return lambda values: (values[field] is not None
+                               and compare(values[field], limit))
+
+    wanted = set(v.lower() for v in operand)
+    if operator in ('=', 'in', '~'):
+        return lambda values: any(v.lower() in wanted for v in values[field])
+    if operator in ('!=', 'not in'):
+        return lambda values: not any(v.lower() in wanted for v in values[field])
+    raise ValueError('Unsupported JQL operator {!r}'.format(operator))
+
+
+def jql_time(value):
+    '''
+    Returns the epoch seconds of a relative JQL time, or an absolute
+    one in UTC
+    '''
+    match = re.match(r'^([-+]?)(\d+)([mhdw])$', value)
+    if match:
+        sign, amount, unit = match.groups()
+        offset = int(amount) * TIME_UNITS[unit]
+        return time.time() + (offset if sign == '+' else -offset)
+    for time_format in ('%Y/%m/%d %H:%M', '%Y-%m-%d %H:%M', '%Y/%m/%d', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(value, time_format))
+        except ValueError:
+            pass
+    raise ValueError('Cannot parse JQL time {!r}'.format(value))
+
+
+class ConduitDataset(object):
+    '''Generated revisions and the PHIDs of their authors
+    '''
+    def __init__(self, revisions, aliases_to_user_ids):
+        self.revisions = revisions
+        self.aliases_to_user_ids = aliases_to_user_ids
+
+
+class ConduitHandler(StandInHandler):
+    '''Answers the Conduit methods the Phabricator scripts call
+    '''
+    def do_POST(self):
+        self.handle_request()
+
+    def route(self, path):
+        if not path.startswith('/api/'):
+            return 404, conduit_error('ERR-CONDUIT-CALL', 'No such path')
+        method = path[len('/api/'):]
+        form = self.read_form()
+        params = json.loads(first(form, 'params', '{}'))
+        params.pop('__conduit__', None)
+        handler = CONDUIT_METHODS.get(method)
+        if handler is None:
+            return 200, conduit_error(
+                'ERR-CONDUIT-CALL',
+                'No stand-in for method "{}"'.format(method)
+            )
+        return 200, {
+            'result': handler(self.server.dataset, **params),
+            'error_code': None,
+            'error_info': None
+        }
+
+
+def conduit_error(code, info):
+    return {'result': None, 'error_code': code, 'error_info': info}
+
+
+def conduit_connect(dataset, **params):
+    return {'connectionID': 1, 'sessionKey': 'stand-in', 'userPHID': None}
+
+
+def user_find(dataset, aliases=()):
+    # Conduit is written in PHP, where an empty map is an empty list
+    return {
+        alias: dataset.aliases_to_user_ids[alias]
+        for alias in aliases if alias in dataset.aliases_to_user_ids
+    } or []
+
+
+def differential_query(dataset, authors=None, ids=None, status=None,
+                       order=None, limit=None, offset=0, **constraints):
+    authors = set(authors) if authors else None
+    ids = set(str(i) for i in ids) if ids else None
+    reviews = [
+        r for r in dataset.revisions
+        if (authors is None or r['authorPHID'] in authors)
+        and (ids is None or r['id'] in ids)
+        and (status not in ('status-open', 'status-closed')
+             or (r['statusName'] in ('Closed', 'Abandoned'))
+             == (status == 'status-closed'))
+    ]
+    if order == 'order-modified':
+        reviews.sort(key=lambda r: -int(r['dateModified']))
+    end = offset + limit if limit else None
+    return reviews[offset:end]
+
+
+def differential_getcommitpaths(dataset, revision_id):
+    return fake_data.fake_commit_paths(revision_id)
+
+
+CONDUIT_METHODS = {
+    'conduit.connect': conduit_connect,
+    'user.find': user_find,
+    'differential.query': differential_query,
+    'differential.getcommitpaths': differential_getcommitpaths,
+}
+
+
+def create_servers(args):
+    '''Generates the datasets and returns the two servers, not yet serving
+    '''
+    issues = fake_data.fake_jira_issue_dicts(
+        args.issues,
+        histories=args.histories,
+        comments=args.comments,
+        hours=args.hours,
+        seed=args.seed
+    )
+    aliases_to_user_ids = {
+        alias: 'PHID-USER-{}'.format(alias) for alias in args.authors
+    }
+    revisions = fake_data.fake_revisions(
+        args.revisions,
+        sorted(aliases_to_user_ids.values()),
+        max_diffs=args.max_diffs,
+        seed=args.seed
+    )
+    return [
+        StandInServer(
+            (args.host, args.jira_port),
+            JiraHandler,
+            JiraDataset(issues, args.seed),
+            args
+        ),
+        StandInServer(
+            (args.host, args.conduit_port),
+            ConduitHandler,
+            ConduitDataset(revisions, aliases_to_user_ids),
+            args
+        )
+    ]
+
+
+def print_stats(servers):
+    for server in servers:
+        print('\n{} on {}:{}'.format(
+            server.RequestHandlerClass.__name__, *server.server_address
+        ))
+        for name, count in sorted(server.stats.items()):
+            print('  {:<50} {:>8}'.format(name, count))
+
+
+def main():
+    args = parse_args()
+    servers = create_servers(args)
+    threads = []
+    for server in servers:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+        print('{} listening on http://{}:{}'.format(
+            server.RequestHandlerClass.__name__, *server.server_address
+        ))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+        print_stats(servers)
+
+
+if __name__ == '__main__':
+    main()
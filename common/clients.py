@@ -0,0 +1,27 @@
+'''
+Process-wide cache of API clients for the report scripts.
+
+A script run from cron creates each client once anyway. Under the
+daemon the scripts run again and again in one process, and reusing a
+client skips reading keys, the OAuth handshake and opening new HTTP
+connections on every run.
+'''
+import threading
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get(key, factory):
+    '''Returns the client cached under key, created with factory() once
+    '''
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def clear():
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,281 @@
+'''
+Runs the report scripts on a schedule from one long-running process.
+
+    python -m common.daemon --jobs-file jobs.json
+
+The jobs file lists each job's script, cron schedule and arguments:
+
+    [
+        {"name": "jira_digest", "script": "jira_digest",
+         "schedule": "0 7 * * 1-5",
+         "args": ["--subscribers-file", "subscribers.txt"]},
+        {"name": "long_reviews", "script": "long_reviews",
+         "schedule": "30 9 * * 1"}
+    ]
+
+Scripts are imported once when the daemon starts, and the JIRA, Gmail
+and Conduit clients, compiled templates and user lookups they create
+stay in memory between runs. Each scheduled run starts after a random
+delay of up to --jitter seconds, at most --max-concurrent jobs run at
+once, and a job is never started while it is already running.
+
+A trigger on 127.0.0.1 runs a job straight away, or lists the jobs:
+
+    curl -X POST http://127.0.0.1:8765/run/jira_digest
+    curl http://127.0.0.1:8765/jobs
+'''
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from datetime import datetime
+import importlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+
+from common.schedule import CronSchedule
+
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Directory of each script that can be run as a job
+SCRIPTS = {
+    'jira_digest': os.path.join('jira', 'jira_digest'),
+    'team_update': 'jira',
+    'long_reviews': 'phabricator',
+    'review_digest': 'phabricator',
+    'reviews_with_tests': 'phabricator',
+}
+TRIGGER_PORT = 8765
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run the report scripts on a schedule.'
+    )
+    parser.add_argument(
+        '--jobs-file',
+        required=True,
+        help='JSON list of {"name", "script", "schedule", "args"} objects'
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=60,
+        help='most seconds to delay each scheduled run by (default: 60)'
+    )
+    parser.add_argument(
+        '--max-concurrent',
+        type=int,
+        default=2,
+        help='most jobs to run at the same time (default: 2)'
+    )
+    parser.add_argument(
+        '--trigger-port',
+        type=int,
+        default=TRIGGER_PORT,
+        help='port on 127.0.0.1 to accept run requests on, or 0 for none '
+             '(default: {})'.format(TRIGGER_PORT)
+    )
+    return parser.parse_args()
+
+
+class Job(object):
+
+    def __init__(self, name, script, schedule, args=()):
+        if script not in SCRIPTS:
+            raise ValueError('Unknown script {!r} for job {!r}'.format(script, name))
+        self.name = name
+        self.script = script
+        self.schedule = CronSchedule(schedule) if schedule else None
+        self.args = list(args)
+        self.main = None
+        self.next_run = None
+        self.pending = False  # waiting for its jitter delay or a free slot
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_start = None
+        self.last_seconds = None
+        self.last_error = None
+
+    def load(self):
+        '''Imports the job's script, once per script
+        '''
+        path = os.path.join(REPO_DIR, SCRIPTS[self.script])
+        if path not in sys.path:
+            sys.path.insert(0, path)
+        self.main = importlib.import_module(self.script).main
+
+    def status(self):
+        return OrderedDict([
+            ('name', self.name),
+            ('script', self.script),
+            ('schedule', self.schedule.expression if self.schedule else None),
+            ('next_run', self.next_run.isoformat() if self.next_run else None),
+            ('pending', self.pending),
+            ('running', self.running),
+            ('runs', self.runs),
+            ('failures', self.failures),
+            ('last_start', self.last_start),
+            ('last_seconds', self.last_seconds),
+            ('last_error', self.last_error),
+        ])
+
+
+def load_jobs(path):
+    with open(path, 'r') as jobs_file:
+        jobs = OrderedDict()
+        for job in json.load(jobs_file):
+            jobs[job['name']] = Job(
+                job['name'],
+                job['script'],
+                job.get('schedule'),
+                job.get('args', [])
+            )
+    for job in jobs.values():
+        job.load()
+    return jobs
+
+
+class Daemon(object):
+
+    def __init__(self, jobs, jitter, max_concurrent):
+        self.jobs = jobs
+        self.jitter = jitter
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def submit(self, job, delay=0):
+        '''
+        Runs the job on a new thread after delay seconds, once a slot is
+        free. Returns False if the job is already waiting or running.
+        '''
+        with self.lock:
+            if job.pending or job.running:
+                return False
+            job.pending = True
+        thread = threading.Thread(target=self.run, args=(job, delay))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def run(self, job, delay):
+        if self.stopped.wait(delay):
+            return
+        with self.slots:
+            with self.lock:
+                job.pending = False
+                job.running = True
+            print('{} Starting {}'.format(datetime.now(), job.name))
+            start = time.time()
+            job.last_start = start
+            try:
+                job.main(list(job.args))
+                job.last_error = None
+            except (Exception, SystemExit) as e:
+                job.failures += 1
+                job.last_error = repr(e)
+                traceback.print_exc()
+            finally:
+                job.last_seconds = time.time() - start
+                job.runs += 1
+                with self.lock:
+                    job.running = False
+            print('{} Finished {} in {:.1f}s'.format(
+                datetime.now(), job.name, job.last_seconds
+            ))
+
+    def serve(self):
+        '''Submits each job as it falls due, until stop() is called
+        '''
+        now = datetime.now()
+        for job in self.jobs.values():
+            if job.schedule:
+                job.next_run = job.schedule.next_run(now)
+        while not self.stopped.is_set():
+            now = datetime.now()
+            for job in self.jobs.values():
+                if job.next_run and job.next_run <= now:
+                    if not self.submit(job, random.uniform(0, self.jitter)):
+                        print('{} Skipping {}, which has not finished'.format(
+                            now, job.name
+                        ))
+                    job.next_run = job.schedule.next_run(now)
+            upcoming = [j.next_run for j in self.jobs.values() if j.next_run]
+            if upcoming:
+                wait = (min(upcoming) - datetime.now()).total_seconds()
+            else:
+                wait = 60
+            # Wake at least each minute in case the clock jumps
+            self.stopped.wait(min(max(wait, 0), 60))
+
+    def stop(self):
+        self.stopped.set()
+
+
+class TriggerHandler(BaseHTTPRequestHandler):
+    '''Runs a job on POST /run/<name> and lists jobs on GET /jobs
+    '''
+    def do_POST(self):
+        daemon = self.server.report_daemon
+        if not self.path.startswith('/run/'):
+            return self.respond(404, {'error': 'not found'})
+        job = daemon.jobs.get(self.path[len('/run/'):])
+        if job is None:
+            return self.respond(404, {'error': 'no such job'})
+        if not daemon.submit(job):
+            return self.respond(409, {'error': 'already running'})
+        self.respond(202, job.status())
+
+    def do_GET(self):
+        if self.path != '/jobs':
+            return self.respond(404, {'error': 'not found'})
+        self.respond(200, [job.status() for job in self.server.report_daemon.jobs.values()])
+
+    def respond(self, status, body):
+        data = json.dumps(body, indent=2)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_trigger(daemon, port):
+    server = HTTPServer(('127.0.0.1', port), TriggerHandler)
+    server.report_daemon = daemon
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    args = parse_args()
+    daemon = Daemon(load_jobs(args.jobs_file), args.jitter, args.max_concurrent)
+    if args.trigger_port:
+        start_trigger(daemon, args.trigger_port)
+        print('Accepting run requests on http://127.0.0.1:{}'.format(
+            args.trigger_port
+        ))
+    for job in daemon.jobs.values():
+        print('{:<24} {}'.format(
+            job.name,
+            job.schedule.expression if job.schedule else 'on request'
+        ))
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
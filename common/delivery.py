@@ -0,0 +1,140 @@
+'''
+Shared SMTP delivery for the report scripts.
+
+An SMTPSession connects and logs in on the first message, then reuses
+the connection for the following ones. It reconnects when the server
+drops the connection and after max_messages messages, since many
+servers limit how many messages one connection may send. A message
+given as a file is streamed to the server, so it is never held in
+memory whole.
+'''
+import os
+
+from common import instrumentation, lazy
+
+smtplib = lazy.module('smtplib')
+
+
+SMTP_HOST = 'smtp.sendgrid.net'
+SMTP_PORT = 587
+BLOCK_SIZE = 64 * 1024  # bytes of a streamed message sent at a time
+
+
+class SMTPSession(object):
+
+    def __init__(self, user, password, host=SMTP_HOST, port=SMTP_PORT,
+                 starttls=False, max_messages=100):
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.max_messages = max_messages
+        self.connection = None
+        self.sent_on_connection = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        with instrumentation.call('smtp.connect'):
+            self.connection = smtplib.SMTP(self.host, self.port)
+            if self.starttls:
+                self.connection.starttls()
+            if self.user:
+                self.connection.login(self.user, self.password)
+        self.sent_on_connection = 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except smtplib.SMTPServerDisconnected:
+                pass
+            self.connection = None
+
+    def send(self, from_addr, to_addrs, message):
+        '''
+        Sends a message, which may be a string, an email.Message or a
+        file holding it, reconnecting once if the server has dropped
+        the connection
+        '''
+        if hasattr(message, 'read'):
+            message.seek(0, os.SEEK_END)
+            size = message.tell()
+            send = self.stream_message
+        else:
+            if not isinstance(message, basestring):
+                message = message.as_string()
+            size = len(message)
+            send = self.send_string
+        if self.sent_on_connection >= self.max_messages:
+            self.close()
+        if self.connection is None:
+            self.connect()
+        with instrumentation.call('smtp.sendmail', bytes_sent=size):
+            try:
+                send(from_addr, to_addrs, message)
+            except smtplib.SMTPServerDisconnected:
+                self.connect()
+                send(from_addr, to_addrs, message)
+        self.sent_on_connection += 1
+
+    def send_string(self, from_addr, to_addrs, message):
+        self.connection.sendmail(from_addr, to_addrs, message)
+
+    def stream_message(self, from_addr, to_addrs, message_file):
+        '''
+        Sends the message in message_file as SMTP.sendmail would, but
+        reads and sends it a block of whole lines at a time
+        '''
+        connection = self.connection
+        if isinstance(to_addrs, basestring):
+            to_addrs = [to_addrs]
+        connection.ehlo_or_helo_if_needed()
+        code, response = connection.mail(from_addr)
+        if code != 250:
+            connection.rset()
+            raise smtplib.SMTPSenderRefused(code, response, from_addr)
+        refused = {}
+        for to_addr in to_addrs:
+            code, response = connection.rcpt(to_addr)
+            if code not in (250, 251):
+                refused[to_addr] = (code, response)
+        if len(refused) == len(to_addrs):
+            connection.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, response = connection.docmd('data')
+        if code != 354:
+            connection.rset()
+            raise smtplib.SMTPDataError(code, response)
+
+        try:
+            message_file.seek(0)
+            block = ''
+            while True:
+                lines = message_file.readlines(BLOCK_SIZE)
+                if not lines:
+                    break
+                # Whole lines, so ending them with CRLF and doubling
+                # leading dots works block by block as for the message
+                block = smtplib.quotedata(''.join(lines))
+                connection.send(block)
+            connection.send('.\r\n' if block.endswith('\r\n') else '\r\n.\r\n')
+        except Exception:
+            # The server would read anything sent next as part of the message
+            connection.close()
+            self.connection = None
+            raise
+        code, response = connection.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def send_batch(self, messages):
+        '''Sends each (from_addr, to_addrs, message) tuple in turn
+        '''
+        for from_addr, to_addrs, message in messages:
+            self.send(from_addr, to_addrs, message)
@@ -0,0 +1,225 @@
+'''
+Per-stage timing and remote call counting for the report scripts.
+
+Scripts wrap each stage of a run (fetch, transform, render, deliver) in
+stage() and their API clients in instrument(). Stages record their total
+time, how often they ran and the process's peak memory. Remote calls
+record their count and time, and track_http() adds the bytes sent and
+received over requests sessions to the call that made the request.
+With --profile the totals are printed at the end of the run, and with
+--profile-log they are appended to a file as a JSON line. start() gives
+each run its own totals, so runs in the report daemon are kept apart.
+'''
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import resource
+import sys
+import threading
+import time
+
+
+_local = threading.local()
+
+
+def peak_memory_kb():
+    '''Returns the peak resident memory of the process in kilobytes
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # reported in bytes rather than kilobytes
+        peak //= 1024
+    return peak
+
+
+class Recorder(object):
+    '''Stage and remote call totals for one run of a script
+    '''
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.calls = OrderedDict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            with self.lock:
+                totals = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+                totals['count'] += 1
+                totals['seconds'] += seconds
+                totals['peak_memory_kb'] = peak_memory_kb()
+
+    @contextmanager
+    def call(self, name, bytes_sent=0):
+        '''Records one remote call under name while the block runs
+        '''
+        with self.lock:
+            totals = self.call_totals(name)
+            totals['count'] += 1
+            totals['bytes_sent'] += bytes_sent
+        previous = getattr(_local, 'call', None)
+        _local.call = (self, name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            _local.call = previous
+            with self.lock:
+                totals['seconds'] += seconds
+
+    def add_bytes(self, name, bytes_sent, bytes_received):
+        with self.lock:
+            totals = self.call_totals(name)
+            totals['bytes_sent'] += bytes_sent
+            totals['bytes_received'] += bytes_received
+
+    def call_totals(self, name):
+        return self.calls.setdefault(name, {
+            'count': 0,
+            'seconds': 0.0,
+            'bytes_sent': 0,
+            'bytes_received': 0
+        })
+
+
+# Used by threads outside of a run started with start()
+_default = Recorder()
+
+
+def recorder():
+    '''Returns the Recorder of the run on this thread
+    '''
+    return getattr(_local, 'recorder', None) or _default
+
+
+def stage(name):
+    return recorder().stage(name)
+
+
+def call(name, bytes_sent=0):
+    return recorder().call(name, bytes_sent)
+
+
+def add_bytes(bytes_sent, bytes_received):
+    '''Adds transferred bytes to the remote call running on this thread
+    '''
+    current = getattr(_local, 'call', None)
+    if current:
+        current[0].add_bytes(current[1], bytes_sent, bytes_received)
+    else:
+        recorder().add_bytes('http', bytes_sent, bytes_received)
+
+
+class CallProxy(object):
+    '''
+    Wraps an API client so that calling any of its methods, including
+    nested ones such as phab.differential.query, is recorded as a call.
+    Calls are recorded for the run that wrapped the client, whichever
+    thread makes them.
+    '''
+    def __init__(self, target, name, recorder):
+        self._target = target
+        self._name = name
+        self._recorder = recorder
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if callable(value) or hasattr(value, '__dict__'):
+            return CallProxy(
+                value,
+                '{}.{}'.format(self._name, attr),
+                self._recorder
+            )
+        return value
+
+    def __call__(self, *args, **kwargs):
+        with self._recorder.call(self._name):
+            return self._target(*args, **kwargs)
+
+
+def instrument(client, name):
+    return CallProxy(client, name, recorder())
+
+
+def track_http():
+    '''
+    Counts the bytes of every request and response sent through a
+    requests session, which both the JIRA and Phabricator clients use
+    '''
+    import requests
+    if getattr(requests.Session.send, 'tracked', False):
+        return
+    send = requests.Session.send
+
+    def tracked_send(session, request, **kwargs):
+        response = send(session, request, **kwargs)
+        body = request.body or ''
+        add_bytes(len(body), len(response.content))
+        return response
+    tracked_send.tracked = True
+    requests.Session.send = tracked_send
+
+
+def add_arguments(parser):
+    '''Adds --profile and --profile-log to an argparse or optparse parser
+    '''
+    add = getattr(parser, 'add_argument', None) or parser.add_option
+    add(
+        '--profile',
+        action='store_true',
+        help='print time, remote calls and memory for each stage'
+    )
+    add(
+        '--profile-log',
+        help='file to append this run\'s profile to as a JSON line'
+    )
+
+
+def start(args):
+    '''
+    Starts recording a run on this thread, separately from earlier runs
+    and from runs on other threads, as under the report daemon
+    '''
+    _local.recorder = Recorder()
+    if args.profile or args.profile_log:
+        track_http()
+
+
+def finish(args, script):
+    if args.profile:
+        report()
+    if args.profile_log:
+        write_json_line(args.profile_log, script)
+
+
+def report():
+    print('\n{:<24} {:>6} {:>10} {:>14}'.format(
+        'stage', 'runs', 'seconds', 'peak memory'
+    ))
+    for name, totals in recorder().stages.items():
+        print('{:<24} {:>6} {:>10.3f} {:>11} KB'.format(
+            name, totals['count'], totals['seconds'], totals['peak_memory_kb']
+        ))
+    print('\n{:<40} {:>6} {:>10} {:>12} {:>12}'.format(
+        'remote call', 'calls', 'seconds', 'bytes sent', 'bytes recv'
+    ))
+    for name, totals in recorder().calls.items():
+        print('{:<40} {:>6} {:>10.3f} {:>12} {:>12}'.format(
+            name, totals['count'], totals['seconds'],
+            totals['bytes_sent'], totals['bytes_received']
+        ))
+
+
+def write_json_line(path, script):
+    with open(path, 'a') as log_file:
+        log_file.write(json.dumps(OrderedDict([
+            ('script', script),
+            ('time', time.time()),
+            ('peak_memory_kb', peak_memory_kb()),
+            ('stages', recorder().stages),
+            ('calls', recorder().calls)
+        ])) + '\n')
@@ -0,0 +1,29 @@
+'''
+Deferred imports for the report scripts.
+
+The API clients, the template engine and the MIME modules take most of
+a script's startup time. module() returns a stand-in that imports the
+real module the first time one of its attributes is used, so --help
+and runs that stop early never pay for the imports they don't reach.
+benchmarks/bench_startup.py shows where startup time goes.
+'''
+import importlib
+
+
+class LazyModule(object):
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self._name)
+
+
+def module(name):
+    return LazyModule(name)
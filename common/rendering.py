@@ -0,0 +1,81 @@
+'''
+Shared Jinja2 environment for the report scripts.
+
+Templates are compiled once per process and the compiled bytecode is
+kept on disk, so later runs skip compilation too. Scripts either add a
+directory of template files or register an inline template string
+under a name, then render it by name.
+'''
+import errno
+import os
+
+from common import lazy
+
+jinja2 = lazy.module('jinja2')
+
+
+BYTECODE_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'productivity-tools', 'jinja'
+)
+
+_template_dirs = []
+_file_loader = None  # created with the environment, on first render
+_inline_templates = {}
+_environment = None
+
+
+def add_template_dir(path):
+    '''Adds a directory of template files to the search path
+    '''
+    path = os.path.abspath(path)
+    if path not in _template_dirs:
+        _template_dirs.append(path)
+        if _file_loader is not None:
+            _file_loader.searchpath.append(path)
+
+
+def register_template(name, source):
+    '''Makes an inline template string available under the given name
+    '''
+    _inline_templates[name] = source
+
+
+def get_environment():
+    global _environment, _file_loader
+    if _environment is None:
+        _file_loader = jinja2.FileSystemLoader(list(_template_dirs))
+        _environment = jinja2.Environment(
+            loader=jinja2.ChoiceLoader([
+                _file_loader,
+                jinja2.DictLoader(_inline_templates)
+            ]),
+            bytecode_cache=create_bytecode_cache()
+        )
+    return _environment
+
+
+def create_bytecode_cache():
+    '''
+    Returns a bytecode cache in BYTECODE_CACHE_DIR, or None if the
+    directory can't be created
+    '''
+    try:
+        os.makedirs(BYTECODE_CACHE_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            print('Not caching templates: {}'.format(e))
+            return None
+    return jinja2.FileSystemBytecodeCache(BYTECODE_CACHE_DIR)
+
+
+def render(name, **context):
+    return get_environment().get_template(name).render(**context)
+
+
+def generate_encoded(name, encoding='utf-8', **context):
+    '''
+    Yields a template's output as encoded bytes, one chunk at a time,
+    so a large report is never held as a whole unicode string
+    '''
+    for chunk in get_environment().get_template(name).generate(**context):
+        yield chunk.encode(encoding)
@@ -0,0 +1,86 @@
+'''
+Cron-style schedules for the report daemon.
+
+A schedule has the five cron fields, minute, hour, day of month, month
+and day of week, each a '*', a number, a range such as 1-5, a step
+such as */15 or a comma separated list of these. Days of the week run
+from 0 for Sunday to 6, and 7 is Sunday as well. @hourly, @daily and
+@weekly are shorthands for the usual schedules.
+'''
+from datetime import timedelta
+
+
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+}
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+class CronSchedule(object):
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError('Expected 5 fields in schedule {!r}'.format(expression))
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [
+            parse_field(field, low, high)
+            for field, (low, high) in zip(fields, FIELD_RANGES)
+        ]
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        # As in cron, a day matches either restricted day field
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def matches_day(self, time):
+        day = time.day in self.days
+        weekday = (time.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, time):
+        return (time.minute in self.minutes and time.hour in self.hours
+                and time.month in self.months and self.matches_day(time))
+
+    def next_run(self, after):
+        '''Returns the first matching minute after the datetime after
+        '''
+        time = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Four years always holds a match for any valid day of the month
+        for _ in xrange(4 * 366 * 24 * 60):
+            if time.month not in self.months or not self.matches_day(time):
+                time = time.replace(hour=0, minute=0) + timedelta(days=1)
+            elif time.hour not in self.hours:
+                time = time.replace(minute=0) + timedelta(hours=1)
+            elif time.minute not in self.minutes:
+                time += timedelta(minutes=1)
+            else:
+                return time
+        raise ValueError('Schedule {!r} never runs'.format(self.expression))
+
+
+def parse_field(field, low, high):
+    '''Returns the set of values a cron field matches
+    '''
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = [int(v) for v in part.split('-', 1)]
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError('Invalid cron field {!r}'.format(field))
+        values.update(range(start, end + 1, step))
+    return values
@@ -0,0 +1,213 @@
+'''
+Append-only local log of JIRA webhook events.
+
+webhook_receiver.py normalizes each issue, comment and changelog webhook
+into one JSON line holding the issue's digest fields and the changelog
+entry or comment it carried, in the same layout as the JIRA API. Lines
+are appended to one file per UTC day, so building a digest only reads
+the days in its time window and never asks JIRA for anything.
+'''
+from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+
+from issue_store import to_record
+
+
+MAX_TEXT_LENGTH = 1000  # the digest shows far less of any text than this
+FILE_PATTERN = 'events-{:%Y-%m-%d}.jsonl'
+
+_lock = threading.Lock()
+
+
+def log_path(log_dir, timestamp):
+    return os.path.join(
+        log_dir,
+        FILE_PATTERN.format(datetime.utcfromtimestamp(timestamp))
+    )
+
+
+def jira_time(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime(
+        '%Y-%m-%dT%H:%M:%S.000+0000'
+    )
+
+
+def cut(text):
+    if text and len(text) > MAX_TEXT_LENGTH:
+        return text[:MAX_TEXT_LENGTH]
+    return text
+
+
+def user_fields(user):
+    if not user:
+        return None
+    return {
+        'key': user.get('key'),
+        'name': user.get('name'),
+        'displayName': user.get('displayName')
+    }
+
+
+def name_fields(value):
+    if not value:
+        return None
+    return {'name': value.get('name')}
+
+
+def normalize(payload, received=None):
+    '''
+    Returns the log record for a webhook payload, or None for webhooks
+    without an issue. The record's time is the webhook's timestamp.
+    Deleting an issue or comment is logged as a record naming what was
+    deleted, which load_issues uses to leave it out of the digest.
+    '''
+    event = payload.get('webhookEvent')
+    issue = payload.get('issue')
+    if not issue:
+        return None
+    timestamp = payload.get('timestamp')
+    timestamp = timestamp / 1000.0 if timestamp else (received or time.time())
+
+    fields = issue.get('fields', {})
+    digest_fields = {
+        'summary': fields.get('summary'),
+        'description': cut(fields.get('description')),
+        'created': fields.get('created'),
+        'issuetype': name_fields(fields.get('issuetype')),
+        'priority': name_fields(fields.get('priority')),
+        'status': name_fields(fields.get('status')),
+        'components': [name_fields(c) for c in fields.get('components') or []],
+        'assignee': user_fields(fields.get('assignee')),
+        'reporter': user_fields(fields.get('reporter'))
+    }
+    record = {
+        'time': timestamp,
+        'webhookEvent': event,
+        'issue': {'key': issue['key'], 'fields': digest_fields}
+    }
+    if event == 'jira:issue_deleted':
+        record['issueDeleted'] = True
+        return record
+
+    changelog = payload.get('changelog')
+    if changelog and changelog.get('items') and payload.get('user'):
+        record['history'] = {
+            'id': str(changelog.get('id', timestamp)),
+            'created': jira_time(timestamp),
+            'author': user_fields(payload['user']),
+            'items': [{
+                'field': item.get('field'),
+                'fromString': cut(item.get('fromString')),
+                'toString': cut(item.get('toString'))
+            } for item in changelog['items']]
+        }
+
+    comment = payload.get('comment')
+    if comment and event == 'comment_deleted':
+        record['deletedComment'] = str(comment['id'])
+    elif comment:
+        record['comment'] = {
+            'id': str(comment['id']),
+            'created': comment['created'],
+            'updated': comment.get('updated', comment['created']),
+            'author': user_fields(comment['author']),
+            'body': cut(comment.get('body'))
+        }
+    return record
+
+
+def append(log_dir, record):
+    '''Appends a record to the log file for the day of its time
+    '''
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    with _lock:
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        with open(log_path(log_dir, record['time']), 'a') as log_file:
+            log_file.write(line)
+
+
+def read(log_dir, since):
+    '''Yields the records logged at or after the since timestamp
+    '''
+    day = datetime.utcfromtimestamp(since).date()
+    today = datetime.utcnow().date()
+    while day <= today:
+        path = os.path.join(log_dir, FILE_PATTERN.format(day))
+        if os.path.exists(path):
+            with open(path, 'r') as log_file:
+                for line in log_file:
+                    record = json.loads(line)
+                    if record['time'] >= since:
+                        yield record
+        day += timedelta(days=1)
+
+
+def load_issues(log_dir, since):
+    '''
+    Returns issues rebuilt from the records logged at or after the
+    since timestamp. Each has the latest fields logged for it, with
+    each logged changelog entry and the latest version of each comment
+    attached, in the layout of a jira Issue resource. A webhook sent
+    more than once is only counted once, and deleted issues and
+    comments are left out. watchers_logged is False on issues whose
+    records were logged without their watchers.
+    '''
+    issues = {}
+    for record in read(log_dir, since):
+        key = record['issue']['key']
+        if record.get('issueDeleted'):
+            issues.pop(key, None)
+            continue
+        issue = issues.setdefault(key, {
+            'key': key,
+            'histories': {},
+            'comments': {},
+            'followers': None
+        })
+        issue['fields'] = record['issue']['fields']
+        if 'history' in record:
+            issue['histories'][record['history']['id']] = record['history']
+        if 'comment' in record:
+            issue['comments'][record['comment']['id']] = record['comment']
+        if 'deletedComment' in record:
+            issue['comments'].pop(record['deletedComment'], None)
+        if 'followers' in record:
+            issue['followers'] = set(record['followers'])
+
+    loaded = []
+    for key in sorted(issues):
+        issue = issues[key]
+        fields = dict(issue['fields'])
+        fields['comment'] = {'comments': sorted(
+            issue['comments'].values(),
+            key=lambda c: c['created']
+        )}
+        followers = set(issue['followers'] or ())
+        if fields.get('assignee'):
+            assignee = fields['assignee']
+            followers.update([assignee['key'], assignee['name']])
+        record = to_record({
+            'key': key,
+            'fields': fields,
+            'changelog': {'histories': sorted(
+                issue['histories'].values(),
+                key=lambda h: h['created']
+            )}
+        })
+        record.followers = frozenset(followers)
+        record.watchers_logged = issue['followers'] is not None
+        loaded.append(record)
+    return loaded
+
+
+def get_followers(issue):
+    '''
+    Returns the keys and names of the issue's assignee, and of its
+    watchers unless webhook_receiver.py was run with
+    --no-lookup-followers
+    '''
+    return issue.followers
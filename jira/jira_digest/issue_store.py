@@ -0,0 +1,163 @@
+'''
+Local SQLite store of JIRA issues, changelog histories and comments.
+
+Issues are saved with the raw JSON returned by the JIRA API, split into
+one row per issue, history entry and comment. Loading an issue rebuilds
+an object with the same attribute layout as a jira Issue resource, so
+the digest can be built from local data.
+'''
+import json
+import sqlite3
+
+from jira_time import parse_jira_time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS issues (
+    key TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    raw TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS histories (
+    issue_key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    created REAL NOT NULL,
+    raw TEXT NOT NULL,
+    PRIMARY KEY (issue_key, id)
+);
+CREATE TABLE IF NOT EXISTS comments (
+    issue_key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    raw TEXT NOT NULL,
+    PRIMARY KEY (issue_key, id)
+);
+CREATE TABLE IF NOT EXISTS followers (
+    issue_key TEXT NOT NULL,
+    user TEXT NOT NULL,
+    PRIMARY KEY (issue_key, user)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    query TEXT PRIMARY KEY,
+    covered_from REAL NOT NULL,
+    last_sync REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS issues_updated ON issues (updated);
+'''
+
+
+class Record(object):
+    '''Gives attribute access to the keys of a raw JSON dict
+    '''
+    def __init__(self, raw):
+        for key, value in raw.items():
+            setattr(self, key, to_record(value))
+
+
+def to_record(value):
+    if isinstance(value, dict):
+        return Record(value)
+    if isinstance(value, list):
+        return [to_record(v) for v in value]
+    return value
+
+
+def open_store(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def get_sync(conn, query):
+    '''
+    Returns a (covered_from, last_sync) tuple for the query, or None
+    if the query has never been synced
+    '''
+    return conn.execute(
+        'SELECT covered_from, last_sync FROM syncs WHERE query = ?',
+        (query,)
+    ).fetchone()
+
+
+def set_sync(conn, query, covered_from, last_sync):
+    conn.execute(
+        'INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)',
+        (query, covered_from, last_sync)
+    )
+    conn.commit()
+
+
+def save_issue(conn, raw, followers):
+    '''
+    Replaces the stored copy of an issue, its changelog histories,
+    comments and followers with the provided raw issue JSON. The raw
+    issue must have been fetched with the changelog expanded.
+    '''
+    raw = dict(raw)
+    fields = dict(raw['fields'])
+    histories = raw.pop('changelog', {}).get('histories', [])
+    comments = fields.pop('comment', {}).get('comments', [])
+    raw['fields'] = fields
+    key = raw['key']
+
+    conn.execute('DELETE FROM histories WHERE issue_key = ?', (key,))
+    conn.execute('DELETE FROM comments WHERE issue_key = ?', (key,))
+    conn.execute('DELETE FROM followers WHERE issue_key = ?', (key,))
+    conn.execute(
+        'INSERT OR REPLACE INTO issues VALUES (?, ?, ?)',
+        (key, parse_jira_time(fields['updated']), json.dumps(raw))
+    )
+    conn.executemany(
+        'INSERT OR REPLACE INTO histories VALUES (?, ?, ?, ?)',
+        [(key, h['id'], parse_jira_time(h['created']), json.dumps(h))
+         for h in histories]
+    )
+    conn.executemany(
+        'INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?)',
+        [(key, c['id'], parse_jira_time(c['created']),
+          parse_jira_time(c['updated']), json.dumps(c))
+         for c in comments]
+    )
+    conn.executemany(
+        'INSERT OR REPLACE INTO followers VALUES (?, ?)',
+        [(key, user) for user in followers]
+    )
+
+
+def load_issues(conn, since):
+    '''
+    Yields issues updated at or after the since timestamp, with only
+    the histories and comments from that point onwards attached
+    '''
+    # Rows are read as they are yielded, so only one raw issue is held
+    rows = conn.execute(
+        'SELECT key, raw FROM issues WHERE updated >= ? ORDER BY key',
+        (since,)
+    )
+    for key, raw in rows:
+        raw = json.loads(raw)
+        raw['changelog'] = {'histories': [
+            json.loads(h) for (h,) in conn.execute(
+                'SELECT raw FROM histories WHERE issue_key = ? '
+                'AND created >= ? ORDER BY created',
+                (key, since)
+            )
+        ]}
+        raw['fields']['comment'] = {'comments': [
+            json.loads(c) for (c,) in conn.execute(
+                'SELECT raw FROM comments WHERE issue_key = ? '
+                'AND (created >= ? OR updated >= ?) ORDER BY created',
+                (key, since, since)
+            )
+        ]}
+        yield to_record(raw)
+
+
+def get_followers(conn, issue):
+    '''Returns the keys and names of the issue's watchers and assignee
+    '''
+    return frozenset(user for (user,) in conn.execute(
+        'SELECT user FROM followers WHERE issue_key = ?',
+        (issue.key,)
+    ))
@@ -1,13 +1,38 @@
 import argparse
+import binascii
+import bisect
 from collections import defaultdict, namedtuple, OrderedDict
-import datetime
-from dateutil import parser
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from jinja2 import Environment, FileSystemLoader, Template
-from jira import JIRA
-import smtplib
+import copy
+import functools
+import itertools
+from multiprocessing.pool import ThreadPool
+import operator
+import os
+import Queue
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import event_log
+import issue_store
+from jira_time import (
+    happened_in_time_window, in_window, jql_time, parse_jira_time,
+    select_in_window, window_start
+)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', '..'))
+from common import clients, delivery, instrumentation, lazy, rendering
+
+jira_api = lazy.module('jira')
+mime_image = lazy.module('email.mime.image')
+mime_multipart = lazy.module('email.mime.multipart')
+mime_nonmultipart = lazy.module('email.mime.nonmultipart')
+
+rendering.add_template_dir(os.path.join(SCRIPT_DIR, 'templates'))
+IMAGE_DIR = os.path.join(SCRIPT_DIR, 'images')
 
 
 JIRA_URL = ''
@@ -30,11 +55,20 @@ JIRA_FIELDS = [  # List of fields to return from api
     'assignee',
     'priority',
     'status',
-    'reporter'
+    'reporter',
+    'components',
+    'updated'
 ]
+# Minutes of overlap between store syncs, to allow for clock skew
+SYNC_OVERLAP_MINUTES = 5
+CHANGELOG_PAGE_SIZE = 100  # the most the changelog endpoint returns
+SPOOL_SIZE = 1024 * 1024  # bytes of a message kept in memory before disk
+QP_BLOCK_SIZE = 64 * 1024  # bytes of text quoted-printable encoded at once
 
 SMTP_USER = ''
 SMTP_PASS = ''
+SMTP_HOST = delivery.SMTP_HOST
+SMTP_PORT = delivery.SMTP_PORT
 
 # Changes won't be included
 CHANGELOG_BLACKLIST = [
@@ -64,33 +98,167 @@ CHANGELOG_TRUNCATE = [
 
 Issue = namedtuple('Issue', ['key', 'summary', 'type', 'priority', 'status'])
 Summary = namedtuple('Summary', ['field', 'author', 'fromStr', 'toStr'])
+# authors holds the key and name of the JIRA user who made the change
+Event = namedtuple('Event', ['time', 'authors', 'summary'])
+# events are in time order, with the time of each in times for slicing
+# by window. followers is None when the JQL query only found the issue
+# because the one user follows it. component_created is the creation time of issues
+# in JIRA_COMPONENTS, and None for other issues.
+IssueEvents = namedtuple(
+    'IssueEvents',
+    ['events', 'times', 'followers', 'is_new', 'component_created']
+)
+# end is None for windows that run up to now
+Window = namedtuple('Window', ['start', 'end', 'label'])
+Subscriber = namedtuple('Subscriber', ['user', 'email'])
+
+_image_parts = None  # loaded by get_image_parts
+_shared = {}  # one copy of each user id set, name and field name
 
 
-def main(args=None):
+def main(argv=None):
     print('Creating Jira Digest email')
 
-    args = parse_args()
-    jql_query = create_jql_query(args)
-    issues = search_issues(jql_query)
-    issues_to_summaries = get_issue_summaries(issues, args)
+    args = parse_args(argv)
+    instrumentation.start(args)
+    subscribers = get_subscribers(args)
+    users = [s.user for s in subscribers]
+
+    with instrumentation.stage('fetch'):
+        if args.event_log:
+            # Built from the webhooks already received, without asking JIRA
+            issues = event_log.load_issues(args.event_log, args.window_start)
+            followers_lookup = event_log.get_followers
+            unwatched = sum(1 for issue in issues if not issue.watchers_logged)
+            if unwatched:
+                print(
+                    'Warning: {} issues in the event log have no watchers, as '
+                    'webhook_receiver.py was run with --no-lookup-followers. '
+                    'They are only included for their assignee.'.format(unwatched)
+                )
+        else:
+            jira = instrumentation.instrument(
+                clients.get(jira_client_key(), create_jira_client),
+                'jira'
+            )
+            issues, followers_lookup = fetch_issues(jira, args, users)
+
+    # Issues are fetched page by page as they are transformed, so the
+    # jira.* remote calls show how much of this stage was network time
+    with instrumentation.stage('transform'):
+        issues_to_events = get_issue_events(issues, args, followers_lookup)
+
+    smtp = delivery.SMTPSession(
+        SMTP_USER,
+        SMTP_PASS,
+        host=args.smtp_host,
+        port=args.smtp_port
+    )
+    with smtp:
+        for window in args.windows:
+            # Every window lies within the one fetched, so each is
+            # sliced from the same events rather than fetched again
+            with instrumentation.stage('slice'):
+                window_events = slice_window(issues_to_events, window)
+            for subscriber in subscribers:
+                subscriber_args = copy.copy(args)
+                subscriber_args.user = subscriber.user
+                subscriber_args.email = subscriber.email
+                subscriber_args.window = window
+                with instrumentation.stage('summarize'):
+                    issues_to_summaries = summarize_for_user(
+                        window_events,
+                        subscriber.user
+                    )
+                send_digest(smtp, issues_to_summaries, subscriber_args)
+
+    instrumentation.finish(args, 'jira_digest')
+
+
+def fetch_issues(jira, args, users):
+    '''
+    Returns the issues updated in the time window, from JIRA or the
+    local store, and a function to look up the followers of an issue
+    '''
+    if args.store:
+        conn = issue_store.open_store(args.store)
+        sync_store(conn, jira, args, users)
+        issues = itertools.islice(
+            issue_store.load_issues(conn, args.window_start),
+            args.max_issues
+        )
+        return issues, functools.partial(issue_store.get_followers, conn)
+
+    zone = jira_time_zone(jira)
+    if args.concurrency > 1:
+        jql_queries = create_jql_shards(
+            users,
+            args.window_start,
+            args.shard_hours * 60,
+            component_field='created',
+            zone=zone
+        )
+    else:
+        jql_queries = [create_jql_query(args, users, zone)]
+    issues = add_changelogs(
+        jira,
+        search_all(jira, jql_queries, args),
+        args.window_start,
+        concurrency=args.concurrency,
+        batch_size=args.page_size
+    )
+    # A single subscriber's query only finds issues the subscriber follows,
+    # besides component issues created since the query's start, which JQL
+    # rounds down to the minute. Watchers only need to be looked up for
+    # those created before the start of the narrowest window, as they are
+    # not new there.
+    if len(users) > 1:
+        return issues, functools.partial(get_followers, jira)
+    return issues, functools.partial(
+        get_component_followers,
+        jira,
+        args.window_start - args.window_start % 60,
+        max(window.start for window in args.windows)
+    )
+
 
+def send_digest(smtp, issues_to_summaries, args):
     if issues_to_summaries:
-        message = generate_message(issues_to_summaries, args)
-        send_email(message, args)
-        print('\nSent Jira Digest')
+        # The message is spooled to disk once it outgrows SPOOL_SIZE, and
+        # streamed from there to the SMTP server
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as message:
+            with instrumentation.stage('render'):
+                write_message(message, issues_to_summaries, args)
+            with instrumentation.stage('deliver'):
+                send_email(smtp, message, args)
+        print('\nSent Jira Digest to {}'.format(args.email))
     else:
-        print('\nNo changes to report')
+        print('\nNo changes to report for {}'.format(args.user))
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description='Send a JIRA digest email summarizing recent changes.'
     )
     parser.add_argument(
         '--hours',
         type=int,
-        default=24,
-        help='summary period in hours preceding now (default: 24)'
+        nargs='+',
+        default=[24],
+        help='summary period in hours preceding now; with several periods, '
+             'one fetch covers them all and a digest is sent for each '
+             '(default: 24)'
+    )
+    parser.add_argument(
+        '--start-time',
+        type=parse_jira_time,
+        help='start of the summary period, instead of --hours, e.g. '
+             '2016-10-17T09:00 (UTC unless an offset is given)'
+    )
+    parser.add_argument(
+        '--end-time',
+        type=parse_jira_time,
+        help='end of the --start-time summary period (default: now)'
     )
     parser.add_argument(
         '--email',
@@ -102,45 +270,459 @@ def parse_args():
         default='amuller',
         help='jira user to summarize'
     )
-    # TODO: Add start_time and end_time flags
-    return parser.parse_args()
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=100,
+        help='number of issues to request per JIRA page (default: 100)'
+    )
+    parser.add_argument(
+        '--max-issues',
+        type=int,
+        default=None,
+        help='stop after this many issues (default: no limit)'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=4,
+        help='number of JQL queries and changelog requests to run at once; '
+             'above 1, the query is split into one for each component, '
+             'watchers and assignees, and --shard-hours of time (default: 4)'
+    )
+    parser.add_argument(
+        '--shard-hours',
+        type=int,
+        default=24,
+        help='hours of changes covered by each split query (default: 24)'
+    )
+    parser.add_argument(
+        '--subscriber',
+        type=parse_subscriber,
+        action='append',
+        default=[],
+        metavar='USER:EMAIL',
+        help='jira user and email address to send a digest to; '
+             'may be repeated (overrides --user and --email)'
+    )
+    parser.add_argument(
+        '--subscribers-file',
+        help='file with one "user email" pair per line to send digests to'
+    )
+    parser.add_argument(
+        '--store',
+        help='sqlite file to keep a local copy of issues in; only issues '
+             'updated since the last run are fetched from JIRA'
+    )
+    parser.add_argument(
+        '--smtp-host',
+        default=SMTP_HOST,
+        help='SMTP server to send email through (default: {})'.format(SMTP_HOST)
+    )
+    parser.add_argument(
+        '--smtp-port',
+        type=int,
+        default=SMTP_PORT,
+        help='SMTP server port (default: {})'.format(SMTP_PORT)
+    )
+    parser.add_argument(
+        '--event-log',
+        help='directory of webhooks logged by webhook_receiver.py to build '
+             'the digest from, instead of querying JIRA'
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.end_time is not None and args.start_time is None:
+        parser.error('--end-time requires --start-time')
+    # Computed once so every timestamp is checked against the same instant
+    args.windows = create_windows(args)
+    # The widest window is the one fetched
+    args.window_start = min(w.start for w in args.windows)
+    args.window_end = args.windows[0].end
+    return args
+
+
+def create_windows(args, now=None):
+    '''
+    Returns a Window for each summary period, the longest first. The
+    --start-time and --end-time flags give one period, and otherwise
+    there is one period for each value of --hours.
+    '''
+    if args.start_time is not None:
+        return [Window(
+            start=args.start_time,
+            end=args.end_time,
+            label='{} to {}'.format(
+                format_time(args.start_time),
+                format_time(args.end_time) if args.end_time else 'now'
+            )
+        )]
+    if now is None:
+        now = time.time()
+    return [
+        Window(
+            start=window_start(hours, now),
+            end=None,
+            label='last {} hours'.format(hours)
+        ) for hours in sorted(set(args.hours), reverse=True)
+    ]
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(timestamp))
+
+
+def parse_subscriber(value):
+    '''Returns the Subscriber for a USER:EMAIL --subscriber flag
+    '''
+    user, _, email = value.partition(':')
+    if not user or not email:
+        raise argparse.ArgumentTypeError(
+            'expected USER:EMAIL, got {!r}'.format(value)
+        )
+    return Subscriber(user=user, email=email)
+
+
+def get_subscribers(args):
+    '''
+    Returns the list of Subscriber tuples to send digests to, read
+    from --subscriber flags and --subscribers-file. Falls back to
+    the --user and --email flags when neither is given.
+    '''
+    subscribers = list(args.subscriber)
+    if args.subscribers_file:
+        with open(args.subscribers_file, 'r') as subscribers_file:
+            for number, line in enumerate(subscribers_file, 1):
+                fields = line.split('#')[0].split()
+                if not fields:
+                    continue
+                if len(fields) != 2:
+                    sys.exit('{}:{}: expected "user email", got {!r}'.format(
+                        args.subscribers_file, number, line.strip()
+                    ))
+                subscribers.append(Subscriber(user=fields[0], email=fields[1]))
+    if not subscribers:
+        subscribers.append(Subscriber(user=args.user, email=args.email))
+    return subscribers
 
 
-def create_jql_query(args):
+def create_jql_query(args, users, zone=None):
     '''
-    Constructs a JQL query using the user and hours parameters
-    from the args parameter. The query searches for relevant issues
-    created in the last X hours, or updated in the last X hours
-    where the issue is assigned or watched by the user.
+    Constructs a JQL query for the start of the widest window in the
+    args parameter and the provided list of users. The query searches
+    for relevant issues created since the start, or updated since the
+    start where the issue is assigned or watched by any user. The start
+    is an absolute time in the zone time zone.
     '''
     jql_query = (
-        'project = HIG and ((component in ({components}) and created >= -{hours}h) '
-        'or ((watcher = {user} or assignee = {user}) and updated >= -{hours}h))'
+        'project = HIG and ((component in ({components}) and created >= {start}) '
+        'or ((watcher in ({users}) or assignee in ({users})) and updated >= {start}))'
     ).format(
         components=", ".join(JIRA_COMPONENTS),
-        hours=args.hours,
-        user=args.user
+        start=jql_time(args.window_start, zone),
+        users=", ".join(users)
     )
     return jql_query
 
 
-def search_issues(jql_query):
-    '''Issues a query to JIRA using the provided JQL query string
+def create_sync_query(users):
+    '''
+    Constructs a JQL query for every issue that may appear in a digest
+    for the provided list of users, whenever it was created or updated
+    '''
+    return (
+        'project = HIG and (component in ({components}) '
+        'or watcher in ({users}) or assignee in ({users}))'
+    ).format(
+        components=", ".join(JIRA_COMPONENTS),
+        users=", ".join(users)
+    )
+
+
+def create_jql_shards(users, start, shard_minutes, component_field,
+                      zone=None, now=None):
+    '''
+    Splits a query for the provided list of users into queries JIRA
+    can run independently: one for each of JIRA_COMPONENTS and one each
+    for watched and assigned issues, each split into slices of
+    shard_minutes going back from now to the start timestamp. Component
+    issues are matched by their component_field time, 'created' for the
+    digest query and 'updated' for the sync query. An issue matching
+    several shards is found by each of them. The slice bounds are
+    absolute times in the JIRA user's time zone, so they stay put while
+    the shards run.
+    '''
+    if now is None:
+        now = time.time()
+    users = ', '.join(users)
+    clauses = [
+        ('component = {}'.format(component), component_field)
+        for component in JIRA_COMPONENTS
+    ]
+    clauses.append(('watcher in ({})'.format(users), 'updated'))
+    clauses.append(('assignee in ({})'.format(users), 'updated'))
+
+    # The oldest slice takes any remainder, rather than a few minutes
+    # getting a query to themselves
+    shard_seconds = shard_minutes * 60
+    slices = max(1, int(round((now - start) / shard_seconds)))
+    bounds = [jql_time(now - i * shard_seconds, zone) for i in range(slices)]
+    bounds.append(jql_time(start, zone))
+    jql_queries = []
+    for clause, field in clauses:
+        for i in range(slices):
+            jql_query = 'project = HIG and {} and {} >= {}'.format(
+                clause, field, bounds[i + 1]
+            )
+            # The newest slice is left open, so issues changed while the
+            # shards run are still found
+            if i:
+                jql_query += ' and {} < {}'.format(field, bounds[i])
+            jql_queries.append(jql_query)
+    return jql_queries
+
+
+def sync_store(conn, jira, args, users):
+    '''
+    Fetches the issues updated since the last sync into the local
+    store. The whole time window is fetched the first time, or when
+    it reaches further back than previous syncs have covered. The sync
+    is not cut off at args.max_issues, as issues past it would never be
+    fetched once the time range is recorded as synced.
+    '''
+    sync_args = copy.copy(args)
+    sync_args.max_issues = None
+    sync_query = create_sync_query(users)
+    now = time.time()
+
+    sync = issue_store.get_sync(conn, sync_query)
+    if sync is None or args.window_start < sync[0]:
+        covered_from = since = args.window_start
+    else:
+        covered_from, since = sync
+
+    since -= SYNC_OVERLAP_MINUTES * 60
+    zone = jira_time_zone(jira)
+    if args.concurrency > 1:
+        jql_queries = create_jql_shards(
+            users,
+            since,
+            args.shard_hours * 60,
+            component_field='updated',
+            zone=zone,
+            now=now
+        )
+    else:
+        jql_queries = ['{query} and updated >= {since}'.format(
+            query=sync_query,
+            since=jql_time(since, zone)
+        )]
+    for issue in search_all(jira, jql_queries, sync_args, expand='changelog'):
+        issue_store.save_issue(conn, issue.raw, get_followers(jira, issue))
+    issue_store.set_sync(conn, sync_query, covered_from, now)
+
+
+def search_issues(jira, jql_query, args, expand=None):
+    '''
+    Issues a query to JIRA using the provided JQL query string.
+    Yields issues one at a time, requesting pages of args.page_size
+    issues until the results or args.max_issues are exhausted.
     '''
     print('\nIssuing JIRA query: {}'.format(jql_query))
-    jira = create_jira_client()
 
     fields = ', '.join(JIRA_FIELDS)
-    issues = jira.search_issues(
-        jql_query,
-        fields=fields,
-        expand='changelog',
-        maxResults=100
+    start_at = 0
+    while args.max_issues is None or start_at < args.max_issues:
+        page_size = args.page_size
+        if args.max_issues is not None:
+            page_size = min(page_size, args.max_issues - start_at)
+        page = jira.search_issues(
+            jql_query,
+            fields=fields,
+            expand=expand,
+            startAt=start_at,
+            maxResults=page_size
+        )
+        page_length = len(page)
+        # Hand the issues over one at a time, so each raw resource can be
+        # freed once it is processed instead of living as long as its page
+        page.reverse()
+        while page:
+            yield page.pop()
+        start_at += page_length
+        if page_length == 0 or start_at >= page.total:
+            break
+
+
+def search_all(jira, jql_queries, args, expand=None):
+    '''
+    Runs the JQL queries on up to args.concurrency threads, each paged
+    through by search_issues, and yields each issue found once, until
+    args.max_issues is reached. Issues pass through a queue of a couple
+    of pages, so the threads wait for the consumer instead of piling
+    results up in memory.
+    '''
+    if len(jql_queries) == 1:
+        for issue in search_issues(jira, jql_queries[0], args, expand):
+            yield issue
+        return
+
+    pending = Queue.Queue()
+    for jql_query in jql_queries:
+        pending.put(jql_query)
+    results = Queue.Queue(maxsize=2 * args.page_size)
+    stopped = threading.Event()
+
+    def put(kind, value):
+        # Gives up once the consumer has stopped, so no thread is left blocked
+        while not stopped.is_set():
+            try:
+                results.put((kind, value), timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def run_shards():
+        try:
+            while not stopped.is_set():
+                try:
+                    jql_query = pending.get_nowait()
+                except Queue.Empty:
+                    break
+                for issue in search_issues(jira, jql_query, args, expand):
+                    if not put('issue', issue):
+                        return
+        except Exception:
+            put('error', sys.exc_info())
+        finally:
+            put('done', None)
+
+    threads = [
+        threading.Thread(target=run_shards)
+        for _ in range(min(args.concurrency, len(jql_queries)))
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    keys = set()
+    running = len(threads)
+    try:
+        while running:
+            kind, value = results.get()
+            if kind == 'done':
+                running -= 1
+            elif kind == 'error':
+                raise value[0], value[1], value[2]
+            elif value.key not in keys:
+                keys.add(value.key)
+                yield value
+                if args.max_issues is not None and len(keys) >= args.max_issues:
+                    break
+    finally:
+        stopped.set()
+
+
+def add_changelogs(jira, issues, since, concurrency=1, batch_size=100):
+    '''
+    Yields the issues with the changelog histories created at or after
+    the since timestamp attached. Only issues updated since then can
+    have such histories, so the changelog is fetched for those alone.
+    Changelogs are fetched on up to concurrency threads, batch_size
+    issues at a time, so no more than a batch of issues is held.
+    '''
+    def attach_changelog(issue):
+        histories = []
+        if happened_in_time_window(issue.fields.updated, since):
+            histories = fetch_changelog(jira, issue.key, since)
+        issue.changelog = issue_store.to_record({'histories': histories})
+        return issue
+
+    if concurrency <= 1:
+        for issue in issues:
+            yield attach_changelog(issue)
+        return
+
+    issues = iter(issues)
+    pool = ThreadPool(concurrency)
+    try:
+        while True:
+            batch = list(itertools.islice(issues, batch_size))
+            if not batch:
+                break
+            # pool.map keeps the batch in order
+            for issue in pool.map(attach_changelog, batch):
+                yield issue
+    finally:
+        pool.close()
+        pool.join()
+
+
+def fetch_changelog(jira, issue_key, since):
+    '''
+    Returns the issue's changelog histories created at or after the
+    since timestamp, oldest first. The changelog is ordered oldest
+    first, so one page holds most changelogs whole. Longer ones are
+    paged from their newest entries backwards, stopping at the first
+    older entry, so the long histories of old issues are never
+    downloaded in full.
+    '''
+    path = 'issue/{}/changelog'.format(issue_key)
+    first_page = jira._get_json(path, params={
+        'startAt': 0,
+        'maxResults': CHANGELOG_PAGE_SIZE
+    })
+    first_values = first_page['values']
+    end = first_page['total']
+    pages = []
+    while end > len(first_values):
+        start_at = max(len(first_values), end - CHANGELOG_PAGE_SIZE)
+        page = jira._get_json(path, params={
+            'startAt': start_at,
+            'maxResults': end - start_at
+        })
+        pages.append(page['values'])
+        if not page['values'] or not happened_in_time_window(
+                page['values'][0]['created'], since):
+            break
+        end = start_at
+    else:
+        # Reached the entries of the first page
+        pages.append(first_values)
+
+    histories = []
+    for values in pages:
+        for entry in reversed(values):
+            if not happened_in_time_window(entry['created'], since):
+                break
+            histories.append(entry)
+    histories.reverse()
+    return histories
+
+
+def jira_client_key():
+    '''Returns the key that clients caches this script's JIRA client under
+    '''
+    return ('jira', JIRA_URL, JIRA_CONSUMER_KEY, JIRA_ACCESS_TOKEN)
+
+
+def jira_time_zone(jira):
+    '''
+    Returns the name of the time zone JIRA reads the client's JQL times
+    in, asked for once per client
+    '''
+    return clients.get(
+        jira_client_key() + ('timeZone',),
+        lambda: jira.myself().get('timeZone')
     )
-    return issues
 
 
 def create_jira_client():
+    if not JIRA_KEY_CERT:
+        # Anonymous access, as to the local stand-in server in benchmarks/
+        return jira_api.JIRA(JIRA_URL)
+
     key_cert_data = None
     with open(JIRA_KEY_CERT, 'r') as key_cert_file:
         key_cert_data = key_cert_file.read()
@@ -151,95 +733,222 @@ def create_jira_client():
         'consumer_key': JIRA_CONSUMER_KEY,
         'key_cert': key_cert_data
     }
-    return JIRA(JIRA_URL, oauth=oauth_dict)
+    return jira_api.JIRA(JIRA_URL, oauth=oauth_dict)
 
 
 def get_issue_summaries(issues, args):
     '''Returns a map of Issue tuples to a list of Summary tuples
     '''
-    issues_to_summaries = defaultdict(list)
+    return summarize_for_user(get_issue_events(issues, args), args.user)
+
+
+def get_issue_events(issues, args, followers_lookup=None):
+    '''
+    Returns a map of Issue tuples to IssueEvents holding every change
+    in the widest time window, whoever made it, in time order. When a
+    followers_lookup function is given, the watchers and assignee it
+    returns for each issue are recorded so the events can be filtered
+    for each subscriber.
+    '''
+    issues_to_events = OrderedDict()
     for issue in issues:
         issue_tuple = Issue(
             key=issue.key,
             summary=issue.fields.summary,
-            type=issue.fields.issuetype.name,
-            priority=issue.fields.priority.name,
-            status=issue.fields.status.name
+            type=shared(issue.fields.issuetype.name),
+            priority=shared(issue.fields.priority.name),
+            status=shared(issue.fields.status.name)
         )
-        add_created(issues_to_summaries, issue, issue_tuple, args)
-        add_changelog(issues_to_summaries, issue, issue_tuple, args)
-        add_comments(issues_to_summaries, issue, issue_tuple, args)
+        events = []
+        add_created(events, issue, args)
+        add_changelog(events, issue, args)
+        add_comments(events, issue, args)
+        if not events:
+            continue
+        # Stable, so events at the same time keep the order added
+        events.sort(key=operator.attrgetter('time'))
+
+        created = get_component_created(issue)
+        is_new = is_new_in(created, args.window_start, args.window_end)
+        followers = None
+        # New issues reach everyone, unless a narrower window leaves
+        # out their creation
+        if followers_lookup and not (is_new and len(args.windows) == 1):
+            followers = followers_lookup(issue)
+        issues_to_events[issue_tuple] = IssueEvents(
+            events=events,
+            times=[event.time for event in events],
+            followers=followers,
+            is_new=is_new,
+            component_created=created
+        )
+    return issues_to_events
+
+
+def get_component_created(issue):
+    '''
+    Returns the creation time of the issue if it is in one of
+    JIRA_COMPONENTS, which makes it relevant to every subscriber
+    when new, or None for other issues
+    '''
+    components = ['"{}"'.format(c.name) for c in issue.fields.components]
+    if any(c in JIRA_COMPONENTS for c in components):
+        return parse_jira_time(issue.fields.created)
+    return None
+
+
+def is_new_in(component_created, start, end):
+    return component_created is not None and in_window(component_created, start, end)
+
+
+def slice_window(issues_to_events, window):
+    '''
+    Returns a map of Issue tuples to IssueEvents holding only the
+    events in the window, found by binary search on the event times
+    '''
+    sliced = OrderedDict()
+    for issue_tuple, issue_events in issues_to_events.iteritems():
+        times = issue_events.times
+        low = bisect.bisect_left(times, window.start)
+        high = len(times)
+        if window.end is not None:
+            high = bisect.bisect_right(times, window.end)
+        if low == high:
+            continue
+        if high - low < len(times):
+            issue_events = issue_events._replace(
+                events=issue_events.events[low:high],
+                times=times[low:high]
+            )
+        sliced[issue_tuple] = issue_events._replace(is_new=is_new_in(
+            issue_events.component_created,
+            window.start,
+            window.end
+        ))
+    return sliced
+
+
+def get_followers(jira, issue):
+    '''Returns the keys and names of the issue's watchers and assignee
+    '''
+    users = list(jira.watchers(issue.key).watchers)
+    if issue.fields.assignee:
+        users.append(issue.fields.assignee)
+    followers = set()
+    for user in users:
+        followers |= user_ids(user)
+    return frozenset(followers)
+
+
+def get_component_followers(jira, queried_from, start, issue):
+    '''
+    Returns the followers of a component issue created from the
+    queried_from timestamp to before the start timestamp, or None for
+    other issues, which a single subscriber's query only finds when
+    they are new or followed by the subscriber
+    '''
+    created = get_component_created(issue)
+    if created is None or not queried_from <= created < start:
+        return None
+    return get_followers(jira, issue)
+
+
+def summarize_for_user(issues_to_events, user):
+    '''
+    Returns a map of Issue tuples to a list of Summary tuples for the
+    issues the user follows, leaving out changes made by the user
+    '''
+    issues_to_summaries = defaultdict(list)
+    for issue_tuple, issue_events in issues_to_events.iteritems():
+        if (issue_events.followers is not None and not issue_events.is_new
+        and user not in issue_events.followers):
+            continue
+        summaries = [
+            event.summary for event in issue_events.events
+            if user not in event.authors
+        ]
+        if summaries:  # avoid inserting empty list into dict
+            issues_to_summaries[issue_tuple] = summaries
 
     sort_summaries(issues_to_summaries)
     return OrderedDict(sorted(issues_to_summaries.items(), key=lambda t: t[0].key))
 
 
-def add_created(issues_to_summaries, issue, issue_tuple, args):
+def add_created(events, issue, args):
     '''
-    Adds a summary entry to the dictionary if the issue was
-    created in the time window by someone other than the user
+    Adds an event to the list if the issue was created in the
+    time window
     '''
-    if (happened_in_time_window(issue.fields.created, args.hours) 
-    and not_user(issue.fields.reporter, args.user)):
-        issues_to_summaries[issue_tuple].append(
-            Summary(
+    created = parse_jira_time(issue.fields.created)
+    if in_window(created, args.window_start, args.window_end):
+        events.append(Event(
+            time=created,
+            authors=user_ids(issue.fields.reporter),
+            summary=Summary(
                 field='Issue Created',
-                author=issue.fields.reporter.displayName,
+                author=shared(issue.fields.reporter.displayName),
                 fromStr="",
                 toStr=truncate(issue.fields.description)
             )
-        )
+        ))
 
 
-def add_changelog(issues_to_summaries, issue, issue_tuple, args):
+def add_changelog(events, issue, args):
     '''
-    Adds a summary entry to the dictionary for each entry in the
-    issue's changelog if the change happened in the time window
-    and was caused by someone other than the user
+    Adds an event to the list for each entry in the issue's
+    changelog if the change happened in the time window
     '''
     history = issue.changelog.histories
-    for entry in history:
-        if (happened_in_time_window(entry.created, args.hours) 
-        and not_user(entry.author, args.user)):
-            summaries = create_summaries(entry)
-            if summaries:  # avoid inserting empty list into dict
-                issues_to_summaries[issue_tuple].extend(summaries)
+    window = select_in_window(
+        history,
+        'created',
+        args.window_start,
+        args.window_end
+    )
+    for created, entry in window:
+        authors = user_ids(entry.author)
+        for summary in create_summaries(entry):
+            events.append(Event(time=created, authors=authors, summary=summary))
 
 
-def add_comments(issues_to_summaries, issue, issue_tuple, args):
+def add_comments(events, issue, args):
     '''
-    Adds a summary entry to the dictionary for each comment on the
-    issue if the comment was created or updated in the time window
-    and was created by someone other than the user
+    Adds an event to the list for each comment on the issue if the
+    comment was created or updated in the time window. A comment's
+    updated time is never before its created time, so only the
+    updated time needs to be checked.
     '''
-    for comment in issue.fields.comment.comments:
-        if ((happened_in_time_window(comment.created, args.hours)
-        or happened_in_time_window(comment.updated, args.hours)) 
-        and not_user(comment.author, args.user)):
-            issues_to_summaries[issue_tuple].append(
-                Summary(
-                    field='Comment',
-                    author=comment.author.displayName,
-                    fromStr="",
-                    toStr=truncate(comment.body)
-                )
+    comments = issue.fields.comment.comments
+    window = select_in_window(
+        comments,
+        'updated',
+        args.window_start,
+        args.window_end
+    )
+    for updated, comment in window:
+        events.append(Event(
+            time=updated,
+            authors=user_ids(comment.author),
+            summary=Summary(
+                field='Comment',
+                author=shared(comment.author.displayName),
+                fromStr="",
+                toStr=truncate(comment.body)
             )
+        ))
 
 
-def happened_in_time_window(date_string, hours_back):
-    '''
-    Determines if the provided date_string occurred in the
-    past hours_back hours
-    '''
-    parsed = parser.parse(date_string)
-    now = datetime.datetime.now()
-    now = now.replace(tzinfo=parsed.tzinfo)
-    delta = now - parsed
-    return delta.total_seconds() <= (hours_back * 3600)
+def user_ids(jira_user):
+    return shared(frozenset([jira_user.key, jira_user.name]))
 
 
-def not_user(jira_user, user):
-    return user != jira_user.key and user != jira_user.name
+def shared(value):
+    '''
+    Returns one shared copy of equal values, such as the names and
+    user ids repeated across every event, so that the events only keep
+    small records alive rather than strings from each raw issue
+    '''
+    return _shared.setdefault(value, value)
 
 
 def create_summaries(entry):
@@ -249,8 +958,8 @@ def create_summaries(entry):
     '''
     return [
         Summary(
-            field=item.field.title(),
-            author=entry.author.displayName,
+            field=shared(item.field.title()),
+            author=shared(entry.author.displayName),
             fromStr=truncate(item.fromString),
             toStr=truncate(item.toString)
         ) for item in entry.items if item.field not in CHANGELOG_BLACKLIST
@@ -274,74 +983,118 @@ def sort_summaries(issues_to_summaries):
        last entry
     '''
     for issue, summaries in issues_to_summaries.items():
-        sorted_summaries = []
-
-        consolidated_summary = []
-        alphabetical_summaries = sorted(summaries, key=lambda t: t.field)
-        for index, summary in enumerate(alphabetical_summaries):
-            # Put Issue Created first
-            if summary.field == 'Issue Created':
-                sorted_summaries.insert(0, summary)
-            # Concatenate fields in CHANGELOG_CONSOLIDATE
-            elif summary.field in CHANGELOG_CONSOLIDATE:
-                if summary.toStr:  # this can be empty for some fields
-                    consolidated_summary.append(summary.toStr)
-                if not next_field_equals_current(alphabetical_summaries, index):
-                    sorted_summaries.append(
-                        Summary(
-                            field=summary.field,
-                            author=summary.author,
-                            fromStr='',
-                            toStr=', '.join(consolidated_summary)
-                        )
-                    )
-                    consolidated_summary = []
-            # Only add the last summary for fields in CHANGELOG_TRUNCATE
-            elif summary.field in CHANGELOG_TRUNCATE:
-                if not next_field_equals_current(alphabetical_summaries, index):
-                    sorted_summaries.append(summary)
-            # All other fields are included in order
-            else:
-                sorted_summaries.append(summary)
+        issues_to_summaries[issue] = consolidate_summaries(summaries)
+
+
+def consolidate_summaries(summaries):
+    '''
+    Groups the summaries by field in a single pass, so the cost grows
+    linearly with the issue's history. Only the distinct field names
+    are sorted. Summaries keep their original order within a field.
+    '''
+    fields_to_summaries = defaultdict(list)
+    for summary in summaries:
+        if summary.field in CHANGELOG_TRUNCATE:
+            fields_to_summaries[summary.field] = [summary]
+        else:
+            fields_to_summaries[summary.field].append(summary)
 
-        issues_to_summaries[issue] = sorted_summaries
+    # Put Issue Created first
+    sorted_summaries = fields_to_summaries.pop('Issue Created', [])[::-1]
+    for field in sorted(fields_to_summaries):
+        field_summaries = fields_to_summaries[field]
+        # Concatenate fields in CHANGELOG_CONSOLIDATE
+        if field in CHANGELOG_CONSOLIDATE:
+            sorted_summaries.append(
+                Summary(
+                    field=field,
+                    author=field_summaries[-1].author,
+                    fromStr='',
+                    toStr=', '.join(
+                        s.toStr for s in field_summaries
+                        if s.toStr  # this can be empty for some fields
+                    )
+                )
+            )
+        else:
+            sorted_summaries.extend(field_summaries)
+    return sorted_summaries
 
 
-def next_field_equals_current(summaries, i):
+def write_message(output, issues_to_summaries, args):
     '''
-    Determines if the Summary tuples in the list of summaries have 
-    the same field at indexes i and i + 1
+    Writes the email message to the output file, rendering the Jinja2
+    template into it a block at a time, so neither the text nor the
+    message is ever held in memory whole
     '''
-    return i + 1 < len(summaries) and summaries[i].field == summaries[i + 1].field
+    # The MIME structure is generated around a placeholder for the text
+    placeholder = uuid.uuid4().hex
+    message = generate_message(issues_to_summaries, args, placeholder)
+    head, tail = message.as_string().split(placeholder)
+    output.write(head)
+    write_quoted_printable(
+        output,
+        rendering.generate_encoded(
+            'email.html',
+            summarized_issues=issues_to_summaries,
+            args=args
+        )
+    )
+    output.write(tail)
 
 
-def generate_message(issues_to_summaries, args):
+def generate_message(issues_to_summaries, args, message_text):
     '''
-    Generates an email message by rendering a Jinja2 template.
-    Loads and attaches necessary images for issue type and priority.
+    Generates an email message with the quoted-printable message_text
+    as its HTML part. Loads and attaches necessary images for issue
+    type and priority.
     '''
-    message = MIMEMultipart('related')
+    message = mime_multipart.MIMEMultipart('related')
     message['Subject'] = 'Jira Digest'
+    if len(args.windows) > 1:
+        message['Subject'] += ' ({})'.format(args.window.label)
     message['From'] = args.email
     message['To'] = args.email
 
-    attach_message_text(message, issues_to_summaries, args)
+    attach_message_text(message, message_text)
     attach_images(message, issues_to_summaries)
     return message
 
 
-def attach_message_text(message, issues_to_summaries, args):
+def attach_message_text(message, message_text):
+    '''Attaches the quoted-printable message_text as the HTML part
+    '''
+    part = mime_nonmultipart.MIMENonMultipart('text', 'html', charset='utf-8')
+    part['Content-Transfer-Encoding'] = 'quoted-printable'
+    part.set_payload(message_text)
+    message.attach(part)
+
+
+def write_quoted_printable(output, chunks):
     '''
-    Renders the Jinja2 email template, and attaches it to the
-    message
+    Writes the byte string chunks to the output file quoted-printable
+    encoded, which for mostly ASCII HTML stays close to its rendered
+    size. Chunks are encoded a block of whole lines at a time, with a
+    soft line break wherever a block has to end within a line.
     '''
-    jinja_env = Environment(loader=FileSystemLoader('templates'))
-    template = jinja_env.get_template('email.html')
-    message_text = template.render(
-        summarized_issues=issues_to_summaries,
-        args=args
-    )
-    message.attach(MIMEText(message_text, 'html', 'utf-8'))
+    block = []
+    size = 0
+    for chunk in chunks:
+        block.append(chunk)
+        size += len(chunk)
+        if size < QP_BLOCK_SIZE:
+            continue
+        text = ''.join(block)
+        end = text.rfind('\n') + 1
+        if end:
+            output.write(binascii.b2a_qp(text[:end]))
+            text = text[end:]
+        else:
+            output.write(binascii.b2a_qp(text) + '=\n')
+            text = ''
+        block = [text]
+        size = len(text)
+    output.write(binascii.b2a_qp(''.join(block)))
 
 
 def attach_images(message, issues_to_summaries):
@@ -370,28 +1123,43 @@ def get_images(issues_to_summaries):
 
 def attach_image(message, cid):
     '''
-    Looks for an image file with the name of the provided cid.
-    Opens the file and attaches it to the message with the
-    appropriate cid.
+    Attaches the preloaded image part with the provided cid
+    to the message
     '''
-    filename = 'images/' + cid + '.png'
-    try:
-        fp = open(filename, 'rb')
-        image = MIMEImage(fp.read(), _subtype='png')
-        fp.close()
-        image.add_header('Content-ID', '<' + cid + '>')
+    image = get_image_parts().get(cid)
+    if image is None:
+        print('Failed to attach image for cid {cid}: no {cid}.png in {dir}'.format(
+            cid=cid,
+            dir=IMAGE_DIR
+        ))
+    else:
         message.attach(image)
-    except IOError as e:
-        print 'Failed to attach image for cid {cid}: {e}'.format(cid=cid, e=e)
 
 
-def send_email(message, args):
-    '''Sends the provided message using SendGrid SMTP
+def get_image_parts():
+    '''
+    Returns a map of cid to MIMEImage parts for every image in
+    IMAGE_DIR. The images are read and encoded once per process,
+    and the same parts are attached to every message.
+    '''
+    global _image_parts
+    if _image_parts is None:
+        _image_parts = {}
+        for filename in os.listdir(IMAGE_DIR):
+            cid, extension = os.path.splitext(filename)
+            if extension != '.png':
+                continue
+            with open(os.path.join(IMAGE_DIR, filename), 'rb') as fp:
+                image = mime_image.MIMEImage(fp.read(), _subtype='png')
+            image.add_header('Content-ID', '<' + cid + '>')
+            _image_parts[cid] = image
+    return _image_parts
+
+
+def send_email(smtp, message, args):
+    '''Sends the provided message over the shared SMTP session
     '''
-    s = smtplib.SMTP('smtp.sendgrid.net', 587)
-    s.login(SMTP_USER, SMTP_PASS)
-    s.sendmail(args.email, args.email, message.as_string())
-    s.quit()
+    smtp.send(args.email, args.email, message)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+'''
+Fast parsing of JIRA timestamps into seconds since the epoch.
+
+JIRA always formats times as ISO-8601 with milliseconds and a UTC
+offset, e.g. 2016-05-01T12:34:56.789-0700, so a regular expression is
+enough to parse them. Parsed values are cached because the same
+timestamps are checked again for every subscriber and window.
+'''
+import calendar
+from datetime import datetime
+import re
+import time
+
+
+JIRA_TIME_PATTERN = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?'
+    r'(?:(Z)|([+-])(\d{2}):?(\d{2}))$'
+)
+CACHE_SIZE = 100000
+
+_cache = {}
+
+
+def parse_jira_time(date_string):
+    '''
+    Converts a JIRA date string to seconds since the epoch, falling
+    back to dateutil for strings not in JIRA's usual format
+    '''
+    try:
+        return _cache[date_string]
+    except KeyError:
+        pass
+
+    match = JIRA_TIME_PATTERN.match(date_string)
+    if match:
+        (year, month, day, hour, minute, second, fraction,
+         utc, sign, offset_hours, offset_minutes) = match.groups()
+        timestamp = float(calendar.timegm((
+            int(year), int(month), int(day),
+            int(hour), int(minute), int(second)
+        )))
+        if fraction:
+            timestamp += float('0.' + fraction)
+        if not utc:
+            offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+            timestamp += -offset if sign == '+' else offset
+    else:
+        # Imported here as it is rarely needed and slow to import
+        from dateutil import parser
+        parsed = parser.parse(date_string)
+        timestamp = calendar.timegm(parsed.utctimetuple())
+        timestamp += parsed.microsecond / 1e6
+
+    if len(_cache) >= CACHE_SIZE:
+        _cache.clear()
+    _cache[date_string] = timestamp
+    return timestamp
+
+
+def window_start(hours_back, now=None):
+    '''Returns the timestamp hours_back hours before now
+    '''
+    if now is None:
+        now = time.time()
+    return now - hours_back * 3600
+
+
+def jql_time(timestamp, zone=None):
+    '''
+    Returns the timestamp as a quoted absolute JQL time in the named
+    time zone, or UTC, as JIRA reads JQL times in the querying user's
+    time zone. JQL times have no seconds, so it is rounded down to the
+    minute.
+    '''
+    # Imported here as it is rarely needed and slow to import
+    from dateutil import tz
+    zone = (zone and tz.gettz(zone)) or tz.tzutc()
+    return datetime.fromtimestamp(timestamp, zone).strftime('"%Y/%m/%d %H:%M"')
+
+
+def in_window(timestamp, start, end=None):
+    '''
+    Determines if the timestamp is at or after start and, when an end
+    is given, at or before end
+    '''
+    return timestamp >= start and (end is None or timestamp <= end)
+
+
+def happened_in_time_window(date_string, start, end=None):
+    '''
+    Determines if the provided JIRA date_string occurred at or
+    after the start timestamp, and at or before any end timestamp
+    '''
+    return in_window(parse_jira_time(date_string), start, end)
+
+
+def select_in_window(items, date_attr, start, end=None):
+    '''
+    Returns (timestamp, item) pairs for the items whose date_attr
+    attribute is a JIRA date string in the window from start to end
+    '''
+    selected = []
+    for item in items:
+        timestamp = parse_jira_time(getattr(item, date_attr))
+        if in_window(timestamp, start, end):
+            selected.append((timestamp, item))
+    return selected
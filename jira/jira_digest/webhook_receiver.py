@@ -0,0 +1,136 @@
+'''
+Receives JIRA webhooks and appends them to a local event log.
+
+    python webhook_receiver.py --event-log events/
+    python jira_digest.py --event-log events/
+
+Register http://<host>:<port>/ in JIRA as a webhook for issue created,
+updated and deleted events and comment events. Every payload is written
+to the log as it arrives, so jira_digest.py can build the digest from
+the log without querying JIRA. Recorded payloads in sample_webhooks/
+can be posted to test a receiver:
+
+    curl -d @sample_webhooks/issue_updated.json http://127.0.0.1:8090/
+'''
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+from SocketServer import ThreadingMixIn
+import sys
+import time
+
+import event_log
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, '..', '..'))
+from common import clients
+
+import jira_digest
+
+PORT = 8090
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Append JIRA webhooks to a local event log.'
+    )
+    parser.add_argument(
+        '--event-log',
+        required=True,
+        help='directory to write the event log to'
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='address to listen on (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=PORT,
+        help='port to listen on (default: {})'.format(PORT)
+    )
+    parser.add_argument(
+        '--no-lookup-followers',
+        dest='lookup_followers',
+        action='store_false',
+        help="don't ask JIRA for the watchers of each updated issue, so "
+             'digests only include issues their subscriber is assigned, '
+             'besides new component issues'
+    )
+    return parser.parse_args(argv)
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, log_dir, lookup_followers=True):
+        HTTPServer.__init__(self, address, WebhookHandler)
+        self.log_dir = log_dir
+        self.lookup_followers = lookup_followers
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    '''Logs the webhook POSTed in each request
+    '''
+    def do_POST(self):
+        received = time.time()
+        length = int(self.headers.getheader('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self.respond(400, {'error': 'body is not JSON'})
+
+        record = event_log.normalize(payload, received)
+        if record is None:
+            return self.respond(202, {'logged': False})
+        # A deleted issue has no watchers left to ask JIRA for
+        if self.server.lookup_followers and not record.get('issueDeleted'):
+            record['followers'] = sorted(lookup_followers(record))
+        event_log.append(self.server.log_dir, record)
+        self.respond(202, {'logged': True})
+
+    def respond(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def lookup_followers(record):
+    '''Returns the keys and names of the watchers and assignee of the issue
+    '''
+    jira = clients.get(jira_digest.jira_client_key(), jira_digest.create_jira_client)
+    followers = set()
+    for user in jira.watchers(record['issue']['key']).watchers:
+        followers |= jira_digest.user_ids(user)
+    assignee = record['issue']['fields']['assignee']
+    if assignee:
+        followers.update([assignee['key'], assignee['name']])
+    return followers
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = WebhookServer(
+        (args.host, args.port),
+        args.event_log,
+        args.lookup_followers
+    )
+    print('Logging webhooks received on http://{}:{} to {}'.format(
+        args.host, args.port, args.event_log
+    ))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,26 @@
-from apiclient import discovery
-from apiclient import errors
 import argparse
 import base64
 from collections import defaultdict
+from collections import namedtuple
 from collections import OrderedDict
-import datetime
-from email.mime.text import MIMEText
-import httplib2
-from jinja2 import Template
-from jira import JIRA
-import oauth2client
-from oauth2client import client
-from oauth2client import tools
+import json
 import os
-import requests
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import clients, instrumentation, lazy, rendering
+
+# The Google API and JIRA clients are slow to import, so they are only
+# imported once a run gets as far as connecting
+client = lazy.module('oauth2client.client')
+discovery = lazy.module('apiclient.discovery')
+errors = lazy.module('apiclient.errors')
+httplib2 = lazy.module('httplib2')
+jira_api = lazy.module('jira')
+mime_text = lazy.module('email.mime.text')
+oauth2client_file = lazy.module('oauth2client.file')
+tools = lazy.module('oauth2client.tools')
 
 
 JIRA_URL = ''
@@ -28,6 +35,22 @@ JIRA_COMPONENTS = [  # Wrap strings in double quotes
     '"Import"',
     '"Frontend"'
 ]
+JIRA_SPRINT_FIELD = 'customfield_10007'
+JIRA_FIELDS = [
+    'summary',
+    'status',
+    'resolutiondate',
+    'components',
+    JIRA_SPRINT_FIELD
+]
+JIRA_PAGE_SIZE = 100
+GMAIL_BATCH_SIZE = 100  # the most requests Gmail allows in one batch
+IN_PROGRESS_STATUSES = ['In Progress', 'In Review']
+COMPLETED_STATUSES = ['Resolved', 'Closed']
+
+# Matches the state and name in a sprint string such as
+# com.atlassian.greenhopper.service.sprint.Sprint@1a2b[id=1,rapidViewId=2,state=ACTIVE,name=Sprint 1,...]
+SPRINT_PATTERN = re.compile(r'[\[,]state=([^,\]]*),name=([^,\]]*)')
 
 SCOPES = 'https://www.googleapis.com/auth/gmail.compose'
 CLIENT_SECRET_FILE = 'client_secret.json'
@@ -37,6 +60,10 @@ FROM = ''
 TO = ''
 TEAM = ''
 
+_sprints = {}  # memoized results of parse_sprint
+
+Team = namedtuple('Team', ['name', 'components', 'to'])
+
 email_template = '''
 {% macro format_jira_key(issue) %}
     <a href="https://interana.atlassian.net/browse/{{ issue }}">{{ issue }}</a>
@@ -66,14 +93,54 @@ email_template = '''
 </body>
 </html>
 '''
+rendering.register_template('team_update.html', email_template)
 
 
-def get_credentials():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Create team update email drafts in Gmail.',
+        epilog='Other arguments, such as --noauth_local_webserver, are '
+               'passed to the oauth2client flow that authorizes Gmail.'
+    )
+    parser.add_argument(
+        '--teams-file',
+        help='JSON list of {"name", "components", "to"} objects to create '
+             'one draft per team for (default: TEAM and JIRA_COMPONENTS)'
+    )
+    instrumentation.add_arguments(parser)
+    args, oauth_args = parser.parse_known_args(argv)
+    args.oauth_args = oauth_args
+    return args
+
+
+def get_teams(args):
+    '''
+    Returns the list of Team tuples to create drafts for, read from
+    --teams-file or else built from the TEAM, JIRA_COMPONENTS and TO
+    settings. Component names are stored without quotes.
+    '''
+    if not args.teams_file:
+        components = [c.strip('"') for c in JIRA_COMPONENTS]
+        return [Team(name=TEAM, components=components, to=TO)]
+    with open(args.teams_file, 'r') as teams_file:
+        return [
+            Team(
+                name=team['name'],
+                components=team['components'],
+                to=team.get('to', TO)
+            ) for team in json.load(teams_file)
+        ]
+
+
+def get_credentials(flags):
     """Gets valid user credentials from storage.
 
     If nothing has been stored, or if the stored credentials are invalid,
     the OAuth2 flow is completed to obtain the new credentials.
 
+    Args:
+        flags: Parsed command line flags for the OAuth2 flow.
+
     Returns:
         Credentials, the obtained credential.
     """
@@ -83,42 +150,83 @@ def get_credentials():
         os.makedirs(credential_dir)
     credential_path = os.path.join(credential_dir, 'team-updates.json')
 
-    store = oauth2client.file.Storage(credential_path)
+    store = oauth2client_file.Storage(credential_path)
     credentials = store.get()
     if not credentials or credentials.invalid:
         flow = client.flow_from_clientsecrets(CLIENT_SECRET_FILE, SCOPES)
         flow.user_agent = APPLICATION_NAME
-        flags = argparse.ArgumentParser(parents=[tools.argparser]).parse_args()
         credentials = tools.run_flow(flow, store, flags)
         print 'Storing credentials to ' + credential_path
     return credentials
 
 
-def get_jira_info():
+def get_jira_info(teams):
+    '''
+    Returns a map of team name to the team's issues sorted by sprint.
+    The issues for every team's components are fetched in one query
+    and split between the teams locally.
+    '''
     print("\nGetting JIRA info...")
-    jira = create_jira_client()
+    jira = instrumentation.instrument(
+        clients.get(jira_client_key(), create_jira_client),
+        'jira'
+    )
+    components = sorted(set(c for team in teams for c in team.components))
 
-    base_query = (
+    query = (
         'project = {project} and Sprint in openSprints() '
-        'and component in ({components})'
+        'and component in ({components}) '
+        'and (status in ("In Progress", "In Review") '
+        'or (status in (Resolved, Closed) and resolutiondate > -7d))'
     ).format(
         project=JIRA_PROJECT,
-        components=", ".join(JIRA_COMPONENTS)
+        components=", ".join('"{}"'.format(c) for c in components)
     )
+    issues = list(search_all_issues(jira, query))
 
-    query = base_query + ' and status in ("In Progress", "In Review")'
-    in_progress_issues = jira.search_issues(query)
+    jira_info = OrderedDict()
+    for team in teams:
+        jira_info[team.name] = sort_by_sprint(
+            issue for issue in issues if in_components(issue, team.components)
+        )
+    return jira_info
 
-    query = base_query + (
-        ' and status in (Resolved, Closed)'
-        ' and resolutiondate > -7d'
-    )
-    completed_issues = jira.search_issues(query)
 
-    return sort_by_sprint(in_progress_issues, completed_issues)
+def in_components(issue, components):
+    return any(c.name in components for c in issue.fields.components)
+
+
+def search_all_issues(jira, query):
+    '''
+    Yields every issue matching the query, requesting only JIRA_FIELDS
+    a page of JIRA_PAGE_SIZE issues at a time
+    '''
+    start_at = 0
+    while True:
+        page = jira.search_issues(
+            query,
+            fields=','.join(JIRA_FIELDS),
+            startAt=start_at,
+            maxResults=JIRA_PAGE_SIZE
+        )
+        for issue in page:
+            yield issue
+        start_at += len(page)
+        if len(page) == 0 or start_at >= page.total:
+            break
+
+
+def jira_client_key():
+    '''Returns the key that clients caches this script's JIRA client under
+    '''
+    return ('jira', JIRA_URL, JIRA_CONSUMER_KEY, JIRA_ACCESS_TOKEN)
 
 
 def create_jira_client():
+    if not JIRA_KEY_CERT:
+        # Anonymous access, as to the local stand-in server in benchmarks/
+        return jira_api.JIRA(JIRA_URL)
+
     key_cert_data = None
     with open(JIRA_KEY_CERT, 'r') as key_cert_file:
         key_cert_data = key_cert_file.read()
@@ -129,33 +237,46 @@ def create_jira_client():
         'consumer_key': JIRA_CONSUMER_KEY,
         'key_cert': key_cert_data
     }
-    return JIRA(JIRA_URL, oauth=oauth_dict)
+    return jira_api.JIRA(JIRA_URL, oauth=oauth_dict)
 
 
-def sort_by_sprint(in_progress_issues, completed_issues):
+def sort_by_sprint(issues):
     sorted = defaultdict(lambda: dict(
             in_progress=OrderedDict(),
             completed=OrderedDict()
         ))
-    for issue in in_progress_issues:
-        sorted[get_sprint(issue)]['in_progress'][issue.key] = issue.fields.summary
-    for issue in completed_issues:
-        sorted[get_sprint(issue)]['completed'][issue.key] = issue.fields.summary
+    for issue in issues:
+        status = issue.fields.status.name
+        if status in IN_PROGRESS_STATUSES:
+            sorted[get_sprint(issue)]['in_progress'][issue.key] = issue.fields.summary
+        elif status in COMPLETED_STATUSES:
+            sorted[get_sprint(issue)]['completed'][issue.key] = issue.fields.summary
     return sorted        
 
 
 def get_sprint(issue):
     # assumes an issue can only be in 1 active sprint
-    sprints = issue.fields.customfield_10007
+    sprints = getattr(issue.fields, JIRA_SPRINT_FIELD)
     for sprint in sprints:
-        attrs = sprint.split(',')
-        status = attrs[2].split('=')[1]
-        name = attrs[3].split('=')[1]
+        status, name = parse_sprint(sprint)
         if status == 'ACTIVE':
             return name
     return ""  # don't break in unexpected case of no active sprints
 
 
+def parse_sprint(sprint):
+    '''
+    Returns the (state, name) of a sprint string, memoized since the
+    same few sprints are shared by every issue
+    '''
+    try:
+        return _sprints[sprint]
+    except KeyError:
+        match = SPRINT_PATTERN.search(sprint)
+        _sprints[sprint] = match.groups() if match else (None, None)
+        return _sprints[sprint]
+
+
 def CreateMessage(sender, to, subject, message_text):
     """Create a message for an email.
 
@@ -168,65 +289,103 @@ def CreateMessage(sender, to, subject, message_text):
     Returns:
         An object containing a base64url encoded email object.
     """
-    message = MIMEText(message_text, 'html', 'utf-8')
+    message = mime_text.MIMEText(message_text, 'html', 'utf-8')
     message['to'] = to
     message['from'] = sender
     message['subject'] = subject
     return {'raw': base64.urlsafe_b64encode(message.as_string())}
 
 
-def CreateDraft(service, user_id, message_body):
-    """Create and insert a draft email. Print the returned draft's message and id.
+def CreateDrafts(service, user_id, message_bodies):
+    """Create and insert draft emails, sending up to GMAIL_BATCH_SIZE drafts
+    per batched API request. Print each returned draft's message and id.
 
     Args:
         service: Authorized Gmail API service instance.
         user_id: User's email address. The special value "me"
         can be used to indicate the authenticated user.
-        message_body: The body of the email message, including headers.
+        message_bodies: List of email message bodies, including headers.
 
     Returns:
-        Draft object, including draft id and message meta data.
+        List of Draft objects in the order of message_bodies, with None
+        for drafts that could not be created.
     """
-    try:
-        message = {'message': message_body}
-        draft = service.users().drafts().create(
-            userId=user_id, 
-            body=message
-        ).execute()
+    drafts = [None] * len(message_bodies)
 
+    def store_draft(request_id, draft, error):
+        if error is not None:
+            print 'An error occurred: %s' % error
+            return
+        drafts[int(request_id)] = draft
         print '\nDraft id: {id}\nDraft message: {message}'.format(
-            id=draft['id'], 
+            id=draft['id'],
             message=draft['message']
         )
-        return draft
-    except errors.HttpError, error:
-        print 'An error occurred: %s' % error
-        return None
-
-
-def main(args=None):
-    print("Creating weekly team update email")
 
-    credentials = get_credentials()
+    for start in range(0, len(message_bodies), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=store_draft)
+        end = min(start + GMAIL_BATCH_SIZE, len(message_bodies))
+        for index in range(start, end):
+            batch.add(
+                service.users().drafts().create(
+                    userId=user_id,
+                    body={'message': message_bodies[index]}
+                ),
+                request_id=str(index)
+            )
+        try:
+            bytes_sent = sum(len(m['raw']) for m in message_bodies[start:end])
+            with instrumentation.call('gmail.batch', bytes_sent=bytes_sent):
+                batch.execute()
+        except errors.HttpError, error:
+            print 'An error occurred: %s' % error
+    return drafts
+
+
+def create_gmail_service(args):
+    # Parsed here rather than in parse_args, where the oauth2client
+    # flags would be the only reason to import it
+    flags = tools.argparser.parse_args(args.oauth_args)
+    credentials = get_credentials(flags)
     http = credentials.authorize(httplib2.Http())
-    service = discovery.build('gmail', 'v1', http=http)
+    return discovery.build('gmail', 'v1', http=http)
 
-    subject = "{team_name} team update".format(team_name=TEAM)
 
-    template = Template(email_template)
-    message_text = template.render(
-        jira_info=get_jira_info()
-    )
+def main(argv=None):
+    print("Creating weekly team update emails")
 
-    message = CreateMessage(
-        FROM, 
-        TO,
-        subject, 
-        message_text
-    )
-    CreateDraft(service, 'me', message)
+    args = parse_args(argv)
+    instrumentation.start(args)
+    teams = get_teams(args)
+    with instrumentation.stage('connect'):
+        service = clients.get(
+            'gmail',
+            lambda: create_gmail_service(args)
+        )
 
-    print("\nFinished generating email")
+    with instrumentation.stage('fetch'):
+        jira_info = get_jira_info(teams)
+
+    with instrumentation.stage('render'):
+        messages = []
+        for team in teams:
+            subject = "{team_name} team update".format(team_name=team.name)
+            message_text = rendering.render(
+                'team_update.html',
+                jira_info=jira_info[team.name]
+            )
+            messages.append(CreateMessage(
+                FROM,
+                team.to,
+                subject,
+                message_text
+            ))
+
+    with instrumentation.stage('deliver'):
+        CreateDrafts(service, 'me', messages)
+
+    print("\nFinished generating emails")
+    instrumentation.finish(args, 'team_update')
 
 
 if __name__ == '__main__':
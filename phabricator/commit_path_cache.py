@@ -0,0 +1,84 @@
+'''
+On-disk cache of the paths changed by each Phabricator revision.
+
+Entries are keyed by revision id and checked against the revision's
+diff count, so an open revision is looked up again once a new diff is
+uploaded. When the cache grows past max_entries, the least recently
+used entries are dropped on save.
+'''
+import json
+import os
+import threading
+import time
+
+
+CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'productivity-tools', 'commit_paths.json'
+)
+MAX_ENTRIES = 10000
+
+
+class CommitPathCache(object):
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as cache_file:
+                self.entries = json.load(cache_file)
+
+    def get(self, revision_id, diff_count):
+        '''
+        Returns the cached paths for the revision, or None if they are
+        missing or were cached for a different number of diffs
+        '''
+        with self.lock:
+            entry = self.entries.get(str(revision_id))
+            if entry is None or entry['diffs'] != diff_count:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry['used'] = time.time()
+            return entry['paths']
+
+    def put(self, revision_id, diff_count, paths):
+        with self.lock:
+            self.entries[str(revision_id)] = {
+                'diffs': diff_count,
+                'paths': paths,
+                'used': time.time()
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            self.evict()
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as cache_file:
+                json.dump(self.entries, cache_file)
+            os.rename(temp_path, self.path)
+
+    def evict(self):
+        '''Drops the least recently used entries beyond max_entries
+        '''
+        excess = len(self.entries) - self.max_entries
+        if excess > 0:
+            by_use = sorted(self.entries, key=lambda k: self.entries[k]['used'])
+            for key in by_use[:excess]:
+                del self.entries[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return 'Commit path cache: {0} hits, {1} misses ({2:.0f}% hit rate)'.format(
+            self.hits,
+            self.misses,
+            self.hits / float(lookups) * 100 if lookups else 0
+        )
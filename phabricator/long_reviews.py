@@ -1,10 +1,16 @@
+import argparse
 from collections import defaultdict
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-import smtplib
+import os
+import sys
 
-from jinja2 import Template
-from phabricator import Phabricator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import clients, delivery, instrumentation, lazy, rendering
+import phab_users
+from review_snapshot import SNAPSHOT_PATH, ReviewSnapshot
+
+mime_text = lazy.module('email.mime.text')
+phabricator = lazy.module('phabricator')
 
 
 ALIASES = [
@@ -30,10 +36,12 @@ MAX_DIFFS = 5
 USER = ''
 PASS = ''
 EMAIL = ''
+SMTP_HOST = delivery.SMTP_HOST
+SMTP_PORT = delivery.SMTP_PORT
 EMAIL_TEMPLATE = '''
 {% macro format_review(review) %}
     <a href="{{ review.uri }}">D{{ review.id }}</a> | {{ review.dateString }} |
-    {{ review.diffs|length }} diffs | {{ review.title }}
+    {{ review.diffCount }} diffs | {{ review.title }}
 {% endmacro %}
 
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN">
@@ -51,42 +59,40 @@ EMAIL_TEMPLATE = '''
 </body>
 </html>
 '''
+rendering.register_template('long_reviews.html', EMAIL_TEMPLATE)
 
 
-def find_user_ids(phab):
-    users = phab.user.find(aliases=ALIASES)
-    return users.response
-
-
-def find_long_reviews(phab, aliases_to_user_ids):
-    reviews = phab.differential.query(
-        authors=aliases_to_user_ids.values(),
-        status='status-open'
-    )
+def find_long_reviews(phab, aliases_to_user_ids, snapshot=None):
+    # Without a snapshot from an earlier run, every open review is fetched
+    if snapshot is None:
+        snapshot = ReviewSnapshot(path=None)
+    snapshot.update(phab, aliases_to_user_ids.values())
     long_reviews = []
     cutoff_date = datetime.now() - timedelta(days=MAX_DAYS)
-    for review in reviews:
+    for review in snapshot.open_reviews():
         date_created = datetime.fromtimestamp(float(review['dateCreated']))
-        if len(review['diffs']) > MAX_DIFFS or date_created < cutoff_date:
-            review['dateString'] = date_created.strftime('%Y-%m-%d')
-            long_reviews.append(review)
+        if review['diffCount'] > MAX_DIFFS or date_created < cutoff_date:
+            long_reviews.append(dict(
+                review,
+                dateString=date_created.strftime('%Y-%m-%d')
+            ))
     return long_reviews
 
 
 def email_report(aliases_to_user_ids, long_reviews):
-    template = Template(EMAIL_TEMPLATE)
-    message_text = template.render(
-        users_to_reviews=map_users_to_reviews(aliases_to_user_ids, long_reviews)
-    )
-    message = MIMEText(message_text, 'html')
-    message['Subject'] = 'Long Code Reviews'
-    message['From'] = EMAIL
-    message['To'] = EMAIL
+    with instrumentation.stage('render'):
+        message_text = rendering.render(
+            'long_reviews.html',
+            users_to_reviews=map_users_to_reviews(aliases_to_user_ids, long_reviews)
+        )
+        message = mime_text.MIMEText(message_text, 'html')
+        message['Subject'] = 'Long Code Reviews'
+        message['From'] = EMAIL
+        message['To'] = EMAIL
 
-    s = smtplib.SMTP('smtp.sendgrid.net', 587)
-    s.login(USER, PASS)
-    s.sendmail(EMAIL, EMAIL, message.as_string())
-    s.quit()
+    with instrumentation.stage('deliver'):
+        with delivery.SMTPSession(USER, PASS, SMTP_HOST, SMTP_PORT) as smtp:
+            smtp.send(EMAIL, EMAIL, message)
 
 
 def map_users_to_reviews(aliases_to_user_ids, reviews):
@@ -98,11 +104,43 @@ def map_users_to_reviews(aliases_to_user_ids, reviews):
     return users_to_reviews
 
 
-def main():
-    phab = Phabricator()
-    aliases_to_user_ids = find_user_ids(phab)
-    long_reviews = find_long_reviews(phab, aliases_to_user_ids)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Email a report of long-running open code reviews.'
+    )
+    parser.add_argument(
+        '--snapshot-file',
+        default=SNAPSHOT_PATH,
+        help='file to keep the open reviews in between runs, so only reviews '
+             'modified since the last run are fetched (default: {})'.format(
+                 SNAPSHOT_PATH
+             )
+    )
+    parser.add_argument(
+        '--no-snapshot',
+        action='store_true',
+        help='fetch every open review again, without reading or writing '
+             'the snapshot file'
+    )
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    instrumentation.start(args)
+    phab = instrumentation.instrument(
+        clients.get('phabricator', lambda: phabricator.Phabricator()),
+        'phab'
+    )
+    snapshot = ReviewSnapshot(None if args.no_snapshot else args.snapshot_file)
+    with instrumentation.stage('fetch'):
+        aliases_to_user_ids = phab_users.find_user_ids(phab, ALIASES)
+        long_reviews = find_long_reviews(phab, aliases_to_user_ids, snapshot)
+    snapshot.save()
+    print(snapshot.stats())
     email_report(aliases_to_user_ids, long_reviews)
+    instrumentation.finish(args, 'long_reviews')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+'''
+Alias to user PHID lookups shared by the Phabricator scripts.
+
+Resolved PHIDs, and aliases Phabricator does not know, are kept in-process
+and on disk for TTL_SECONDS, so a warm cache skips the user.find call
+entirely. Aliases missing from the cache are resolved together in one call.
+'''
+import json
+import os
+import time
+
+
+CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'productivity-tools', 'phab_users.json'
+)
+TTL_SECONDS = 7 * 24 * 3600
+
+# Alias to {'phid': ..., 'fetched': ...}, with a phid of None for
+# aliases Phabricator does not know
+_entries = {}
+
+
+def find_user_ids(phab, aliases, cache_path=CACHE_PATH):
+    '''Returns a map of each alias that Phabricator knows to its PHID
+    '''
+    now = time.time()
+    missing = [a for a in aliases if not is_fresh(_entries.get(a), now)]
+    if missing:
+        cache = load_cache(cache_path)
+        for alias in missing:
+            if is_fresh(cache.get(alias), now):
+                _entries[alias] = cache[alias]
+
+        missing = [a for a in missing if not is_fresh(_entries.get(a), now)]
+        if missing:
+            # Conduit sends an empty map as an empty list
+            found = phab.user.find(aliases=missing).response or {}
+            for alias in missing:
+                entry = {'phid': found.get(alias), 'fetched': now}
+                _entries[alias] = cache[alias] = entry
+            save_cache(cache_path, cache)
+
+    return {
+        alias: _entries[alias]['phid']
+        for alias in aliases if _entries[alias]['phid']
+    }
+
+
+def is_fresh(entry, now):
+    return entry is not None and now - entry['fetched'] < TTL_SECONDS
+
+
+def load_cache(cache_path):
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r') as cache_file:
+            return json.load(cache_file)
+    return {}
+
+
+def save_cache(cache_path, cache):
+    if not cache_path:
+        return
+    directory = os.path.dirname(cache_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'w') as cache_file:
+        json.dump(cache, cache_file)
+    os.rename(temp_path, cache_path)
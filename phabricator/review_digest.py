@@ -1,10 +1,15 @@
+import argparse
 from collections import defaultdict
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-import smtplib
+import os
+import sys
 
-from jinja2 import Template
-from phabricator import Phabricator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import clients, delivery, instrumentation, lazy, rendering
+import phab_users
+
+mime_text = lazy.module('email.mime.text')
+phabricator = lazy.module('phabricator')
 
 
 ALIASES = [
@@ -25,10 +30,13 @@ ALIASES = [
 
 MAX_DAYS = 7
 MAX_DIFFS = 5
+PAGE_SIZE = 100
 
 USER = ''
 PASS = ''
 EMAIL = ''
+SMTP_HOST = delivery.SMTP_HOST
+SMTP_PORT = delivery.SMTP_PORT
 
 EMAIL_TEMPLATE = '''
 {% macro format_review(review) %}
@@ -70,56 +78,105 @@ EMAIL_TEMPLATE = '''
 </body>
 </html>
 '''
+rendering.register_template('review_digest.html', EMAIL_TEMPLATE)
+
+
+def query_reviews(phab, user_ids, **constraints):
+    '''
+    Yields the reviews by any of the users matching the constraints,
+    newest first, fetching PAGE_SIZE reviews at a time
+    '''
+    offset = 0
+    while True:
+        page = phab.differential.query(
+            authors=user_ids,
+            order='order-created',
+            limit=PAGE_SIZE,
+            offset=offset,
+            **constraints
+        )
+        for review in page:
+            yield review
+        if len(page) < PAGE_SIZE:
+            break
+        offset += len(page)
+
+
+def sort_review(sorted_reviews, review, cutoff_date):
+    date_created = datetime.fromtimestamp(float(review['dateCreated']))
+    if date_created > cutoff_date:
+        sorted_reviews['new_reviews'].append(review)
+        review['dateString'] = date_created.strftime('%Y-%m-%d')
+    if (len(review['diffs']) > MAX_DIFFS or date_created < cutoff_date) \
+    and review['statusName'] not in ['Closed', 'Abandoned']:
+        review['dateString'] = date_created.strftime('%Y-%m-%d')
+        sorted_reviews['long_reviews'].append(review)
 
 
-def find_user_ids(phab):
-    users = phab.user.find(aliases=ALIASES)
-    return users.response
-
-
-def find_reviews_for_user(phab, user_id):
-    reviews = phab.differential.query(authors=[user_id])
-    sorted_reviews = defaultdict(list)
+def find_reviews(phab, aliases_to_user_ids):
+    '''
+    Finds new and long reviews for every user with two paged queries
+    across all authors: reviews created since the cutoff in any
+    status, then older reviews that are still open
+    '''
+    print 'Finding reviews for {} users'.format(len(aliases_to_user_ids))
+    user_ids_to_aliases = {v: k for k, v in aliases_to_user_ids.iteritems()}
+    reviews = {alias: defaultdict(list) for alias in aliases_to_user_ids}
     cutoff_date = datetime.now() - timedelta(days=MAX_DAYS)
-    for review in reviews:
-        date_created = datetime.fromtimestamp(float(review['dateCreated']))
-        if date_created > cutoff_date:
-            sorted_reviews['new_reviews'].append(review)
-            review['dateString'] = date_created.strftime('%Y-%m-%d')
-        if (len(review['diffs']) > MAX_DIFFS or date_created < cutoff_date) \
-        and review['statusName'] not in ['Closed', 'Abandoned']:
-            review['dateString'] = date_created.strftime('%Y-%m-%d')
-            sorted_reviews['long_reviews'].append(review)
-    return sorted_reviews
-
+    user_ids = aliases_to_user_ids.values()
 
-def find_reviews(phab, aliases_to_user_ids):
-    reviews = {}
-    for alias, user_id in aliases_to_user_ids.iteritems():
-        print 'Finding reviews for {}'.format(alias)
-        reviews[alias] = find_reviews_for_user(phab, user_id)
+    seen = set()
+    for review in query_reviews(phab, user_ids):
+        date_created = datetime.fromtimestamp(float(review['dateCreated']))
+        if date_created <= cutoff_date:
+            break
+        seen.add(review['id'])
+        alias = user_ids_to_aliases[review['authorPHID']]
+        sort_review(reviews[alias], review, cutoff_date)
+
+    for review in query_reviews(phab, user_ids, status='status-open'):
+        if review['id'] not in seen:
+            alias = user_ids_to_aliases[review['authorPHID']]
+            sort_review(reviews[alias], review, cutoff_date)
     return reviews
 
 
 def email_report(users_to_reviews):
-    template = Template(EMAIL_TEMPLATE)
-    message_text = template.render(users_to_reviews=users_to_reviews)
-    message = MIMEText(message_text, 'html')
-    message['Subject'] = 'Phabricator Digest'
-    message['From'] = EMAIL
-    message['To'] = EMAIL
-
-    s = smtplib.SMTP('smtp.sendgrid.net', 587)
-    s.login(USER, PASS)
-    s.sendmail(EMAIL, EMAIL, message.as_string())
-    s.quit()
-
-
-def main():
-    phab = Phabricator()
-    aliases_to_user_ids = find_user_ids(phab)
-    users_to_reviews = find_reviews(phab, aliases_to_user_ids)
+    with instrumentation.stage('render'):
+        message_text = rendering.render(
+            'review_digest.html',
+            users_to_reviews=users_to_reviews
+        )
+        message = mime_text.MIMEText(message_text, 'html')
+        message['Subject'] = 'Phabricator Digest'
+        message['From'] = EMAIL
+        message['To'] = EMAIL
+
+    with instrumentation.stage('deliver'):
+        with delivery.SMTPSession(USER, PASS, SMTP_HOST, SMTP_PORT) as smtp:
+            smtp.send(EMAIL, EMAIL, message)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Email a digest of new and long code reviews.'
+    )
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    instrumentation.start(args)
+    phab = instrumentation.instrument(
+        clients.get('phabricator', lambda: phabricator.Phabricator()),
+        'phab'
+    )
+    with instrumentation.stage('fetch'):
+        aliases_to_user_ids = phab_users.find_user_ids(phab, ALIASES)
+        users_to_reviews = find_reviews(phab, aliases_to_user_ids)
     email_report(users_to_reviews)
+    instrumentation.finish(args, 'review_digest')
 
 
 if __name__ == "__main__":
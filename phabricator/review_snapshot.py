@@ -0,0 +1,143 @@
+'''
+On-disk snapshot of the open Phabricator revisions of a set of authors.
+
+The first run fetches every open revision. Later runs page through the
+authors' revisions, and the revisions already in the snapshot, from the
+most recently modified, only back to the latest modification time
+already seen, and update the snapshot with them. Revisions that were
+closed or abandoned, or commandeered by someone outside the authors,
+are dropped. Each revision keeps its number of diffs rather than the
+list of diff ids.
+'''
+import itertools
+import json
+import os
+
+
+SNAPSHOT_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'productivity-tools', 'open_reviews.json'
+)
+CLOSED_STATUSES = ('Closed', 'Abandoned')
+PAGE_SIZE = 100
+# Seconds of overlap between updates, as modification times are whole
+# seconds and a revision can change again within the same second
+OVERLAP_SECONDS = 60
+
+
+class ReviewSnapshot(object):
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.authors = None
+        self.modified = None  # latest dateModified seen, the cursor
+        self.reviews = {}
+        self.fetched = 0
+        if path and os.path.exists(path):
+            with open(path, 'r') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.authors = snapshot['authors']
+            self.modified = snapshot['modified']
+            self.reviews = snapshot['reviews']
+
+    def update(self, phab, author_ids):
+        '''
+        Brings the snapshot up to date with the open revisions of the
+        authors, fetching them all when the authors have changed
+        '''
+        author_ids = sorted(author_ids)
+        if author_ids != self.authors or self.modified is None:
+            self.authors = author_ids
+            self.modified = None
+            self.reviews = {}
+            revisions = phab.differential.query(
+                authors=author_ids,
+                status='status-open'
+            )
+        else:
+            since = self.modified - OVERLAP_SECONDS
+            revisions = self.modified_revisions(phab, since, authors=self.authors)
+            if self.reviews:
+                # A revision commandeered by someone outside the authors
+                # is only found by its id
+                revisions = itertools.chain(revisions, self.modified_revisions(
+                    phab,
+                    since,
+                    ids=sorted(int(review_id) for review_id in self.reviews)
+                ))
+
+        for revision in revisions:
+            self.fetched += 1
+            modified = int(revision['dateModified'])
+            if self.modified is None or modified > self.modified:
+                self.modified = modified
+            if (revision['statusName'] in CLOSED_STATUSES
+                    or revision['authorPHID'] not in self.authors):
+                self.reviews.pop(revision['id'], None)
+            else:
+                self.reviews[revision['id']] = to_entry(revision)
+
+    def modified_revisions(self, phab, since, **constraints):
+        '''
+        Yields the revisions matching the differential.query constraints,
+        open or not, modified at or after the since timestamp, most
+        recently modified first
+        '''
+        offset = 0
+        while True:
+            page = phab.differential.query(
+                order='order-modified',
+                limit=PAGE_SIZE,
+                offset=offset,
+                **constraints
+            )
+            for revision in page:
+                if int(revision['dateModified']) < since:
+                    return
+                yield revision
+            if len(page) < PAGE_SIZE:
+                return
+            offset += PAGE_SIZE
+
+    def open_reviews(self):
+        '''Returns the snapshot's revisions, most recently created first
+        '''
+        return sorted(
+            self.reviews.values(),
+            key=lambda r: -int(r['dateCreated'])
+        )
+
+    def stats(self):
+        return 'Review snapshot: {0} open revisions, {1} fetched'.format(
+            len(self.reviews),
+            self.fetched
+        )
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump({
+                'authors': self.authors,
+                'modified': self.modified,
+                'reviews': self.reviews
+            }, snapshot_file)
+        os.rename(temp_path, self.path)
+
+
+def to_entry(revision):
+    '''Returns the fields of a differential.query result the reports use
+    '''
+    return {
+        'id': revision['id'],
+        'uri': revision['uri'],
+        'title': revision['title'],
+        'authorPHID': revision['authorPHID'],
+        'statusName': revision['statusName'],
+        'dateCreated': revision['dateCreated'],
+        'dateModified': revision['dateModified'],
+        'diffCount': len(revision['diffs'])
+    }
@@ -1,35 +1,69 @@
 #!/usr/bin/python
+import functools
+from multiprocessing.pool import ThreadPool
 import optparse
+import os
 import sys
 
-from phabricator import Phabricator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from commit_path_cache import CACHE_PATH, CommitPathCache
+from common import clients, instrumentation, lazy
+import phab_users
 
+phabricator = lazy.module('phabricator')
 
-def parse_args():
-    usage = './%prog user1 [user2 ...]'
+
+def parse_args(argv=None):
+    usage = './%prog [options] user1 [user2 ...]'
     parser = optparse.OptionParser(usage=usage)
-    opts, args = parser.parse_args()
+    parser.add_option(
+        '-c', '--concurrency',
+        type='int',
+        default=8,
+        help='number of concurrent Phabricator requests (default: %default)'
+    )
+    parser.add_option(
+        '--cache-file',
+        default=CACHE_PATH,
+        help='file to cache the paths changed by each revision in '
+             '(default: %default)'
+    )
+    parser.add_option(
+        '--no-cache',
+        action='store_true',
+        help='look up every revision\'s paths again'
+    )
+    instrumentation.add_arguments(parser)
+    opts, args = parser.parse_args(argv)
     if len(args) < 1:
         parser.print_help()
         sys.exit(0)
-    return args
-
-
-def find_user_ids(aliases, phab):
-    users = phab.user.find(aliases=aliases)
-    return users.response
+    return opts, args
 
 
-def find_reviews_with_tests(usernames_to_user_ids, phab):
-    for username, user_id in usernames_to_user_ids.iteritems():
-        all_reviews = phab.differential.query(
-            authors=[user_id],
-            limit=100  # TODO: make limit configurable
+def find_reviews_with_tests(usernames_to_user_ids, phab, concurrency, cache):
+    # Reviews for every user, then the commit paths of every review,
+    # are fetched through a pool of concurrency threads. pool.map keeps
+    # the results in order, so the output is the same as running serially.
+    usernames = list(usernames_to_user_ids)
+    pool = ThreadPool(concurrency)
+    try:
+        reviews_by_user = pool.map(
+            functools.partial(find_reviews, phab=phab),
+            [usernames_to_user_ids[username] for username in usernames]
         )
-        reviews_with_tests = []
-        for review in all_reviews:
-            if contains_test_change(review, phab):
-                reviews_with_tests.append(review)
+        test_changes = iter(pool.map(
+            functools.partial(contains_test_change, phab=phab, cache=cache),
+            [review for reviews in reviews_by_user for review in reviews]
+        ))
+    finally:
+        pool.close()
+        pool.join()
+
+    for username, all_reviews in zip(usernames, reviews_by_user):
+        reviews_with_tests = [
+            review for review in all_reviews if next(test_changes)
+        ]
         print '{0}: {1} out of {2} code reviews have a test change ({3:.0f}%)'.format(
             username,
             len(reviews_with_tests),
@@ -38,7 +72,14 @@ def find_reviews_with_tests(usernames_to_user_ids, phab):
         )
 
 
-def contains_test_change(review, phab):
+def find_reviews(user_id, phab):
+    return phab.differential.query(
+        authors=[user_id],
+        limit=100  # TODO: make limit configurable
+    )
+
+
+def contains_test_change(review, phab, cache):
     # The paths argument to the query api can find changes to
     # tests/ and integration_tests/ in one call. However, it cannot
     # detect our C++ tests which are distinguished by filename
@@ -47,9 +88,14 @@ def contains_test_change(review, phab):
     # Unfortunately this api only supports one review id at a time.
     # A batch endpoint would speed up the runtime of the script
     # considerably.
-    commits = phab.differential.getcommitpaths(
-        revision_id=int(review['id'])
-    )
+    revision_id = int(review['id'])
+    diff_count = len(review['diffs'])
+    commits = cache.get(revision_id, diff_count)
+    if commits is None:
+        commits = list(phab.differential.getcommitpaths(
+            revision_id=revision_id
+        ))
+        cache.put(revision_id, diff_count, commits)
     for commit in commits:
         if 'test' in commit:
             return True
@@ -62,11 +108,20 @@ def percent(x, y):
     return x / float(y) * 100
 
 
-def main():
-    usernames = parse_args()
-    phab = Phabricator()
-    usernames_to_user_ids = find_user_ids(usernames, phab)
-    find_reviews_with_tests(usernames_to_user_ids, phab)
+def main(argv=None):
+    opts, usernames = parse_args(argv)
+    instrumentation.start(opts)
+    phab = instrumentation.instrument(
+        clients.get('phabricator', lambda: phabricator.Phabricator()),
+        'phab'
+    )
+    with instrumentation.stage('fetch'):
+        usernames_to_user_ids = phab_users.find_user_ids(phab, usernames)
+        cache = CommitPathCache(None if opts.no_cache else opts.cache_file)
+        find_reviews_with_tests(usernames_to_user_ids, phab, opts.concurrency, cache)
+        cache.save()
+    print cache.stats()
+    instrumentation.finish(opts, 'reviews_with_tests')
 
 
 if __name__ == "__main__":